@@ -0,0 +1,92 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from logging import Logger
+from typing import List, Tuple
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Puts log records on a queue as they are, so formatting is done by the listener thread.
+
+    The standard QueueHandler formats the message in the logging thread, to make records safe
+    to pickle. Records here stay in the process, so only the arguments need to be left alone
+    after logging them.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single json line. Timing fields passed with
+    `extra={"timing": {...}}` are included as they are."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "time": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        timing = getattr(record, "timing", None)
+        if timing:
+            line["timing"] = timing
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return json.dumps(line, separators=(",", ":"), default=str)
+
+
+class LazyJson:
+    """Log argument that is only converted to json when the message is formatted."""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self) -> str:
+        return json.dumps(self.value, separators=(",", ":"), default=str)
+
+
+def start_queue_logging(logger: Logger, handlers: List[logging.Handler]) -> logging.handlers.QueueListener:
+    """Attaches handlers to a logger through a queue, so writing to the console or disk happens
+    on a background thread instead of the thread logging the message."""
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)  # flushes the queue on exit
+    return listener
+
+
+class LogSampler:
+    """Limits a frequent log message to a number per second and counts what was left out."""
+    max_per_sec: int
+
+    def __init__(self, max_per_sec: int):
+        self.max_per_sec = max_per_sec
+        self._lock = threading.Lock()
+        self._window_start = float("-inf")
+        self._count = 0
+        self._suppressed = 0
+
+    def sample(self) -> Tuple[bool, int]:
+        """Returns whether to log this occurrence and how many were left out before it."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._count = 0
+            if self._count >= self.max_per_sec:
+                self._suppressed += 1
+                return False, 0
+            self._count += 1
+            suppressed, self._suppressed = self._suppressed, 0
+            return True, suppressed
@@ -0,0 +1,54 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import threading
+import time
+from logging import Logger
+
+RETRY_SEC = 5  # doubles with each failed attempt
+MAX_RETRY_SEC = 60
+
+
+class BackgroundRefresh:
+    """Mixin for caches rebuilt from a Hue bridge, such as the group index and the button routes.
+
+    Subclasses implement `_rebuild` and call `_init_refresh` from their constructor. A refresh
+    requested while one is waiting to run is coalesced into it. A failed refresh is retried with
+    increasing delays until it succeeds, so a bridge that is unreachable at startup does not leave
+    the cache empty for good.
+    """
+    refresh_name: str  # what is refreshed, for log messages
+    logger: Logger
+
+    def _init_refresh(self):
+        self._refresh_lock = threading.Lock()
+        self._refresh_pending = threading.Event()
+
+    def _rebuild(self):
+        raise NotImplementedError
+
+    def refresh(self):
+        """Rebuilds the cache from the bridge, raises when that fails."""
+        with self._refresh_lock:
+            self._refresh_pending.clear()  # a change from now on needs another refresh
+            self._rebuild()
+
+    def refresh_until_done(self):
+        """Refreshes, retrying with increasing delays until it succeeds."""
+        delay_sec = RETRY_SEC
+        while True:
+            try:
+                self.refresh()
+                return
+            except Exception as e:
+                self._refresh_pending.set()  # requests during the delay are answered by the retry
+                self.logger.error(f"Cannot refresh {self.refresh_name}: {e}, retrying in {delay_sec} s")
+            time.sleep(delay_sec)
+            delay_sec = min(delay_sec * 2, MAX_RETRY_SEC)
+
+    def refresh_async(self):
+        """Refreshes in the background, coalescing requests that arrive before the refresh starts."""
+        if self._refresh_pending.is_set():
+            return
+        self._refresh_pending.set()
+        threading.Thread(target=self.refresh_until_done, daemon=True).start()
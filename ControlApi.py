@@ -0,0 +1,180 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import asyncio
+import json
+import threading
+from logging import Logger
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+
+if TYPE_CHECKING:
+    from DmxController import DmxController
+
+
+def parse_channel_write(body: Dict[str, Any], max_channels: int = 512) -> Tuple[int, bytes]:
+    """Validates a write of {"address": <1-512>, "values": [<0-255>, ...]}, returns (address, data)."""
+    if not isinstance(body, dict):
+        raise ValueError("expected a json object")
+    address = body.get("address")
+    values = body.get("values")
+    if not isinstance(address, int) or not 1 <= address <= 512:
+        raise ValueError("address must be a DMX address from 1 to 512")
+    if not isinstance(values, list) or not values or not all(isinstance(v, int) and 0 <= v <= 255 for v in values):
+        raise ValueError("values must be a non-empty list of channel values from 0 to 255")
+    if len(values) > max_channels or address + len(values) > 513:
+        raise ValueError("values exceed the channels available at this address")
+    return address, bytes(values)
+
+
+class ControlApi:
+    """Local HTTP and WebSocket API for show control software.
+
+    GET  /state               fixtures, the DMX universe, frame timing and Hue request metrics
+    PUT  /channels            {"address": 10, "values": [255, 0]} writes channels directly
+    PUT  /fixtures/{name}     {"values": [255, 0, 0, 0]} writes the channels of a fixture
+    GET  /ws                  streams every DMX frame sent as 512 binary channel values, and
+                              accepts channel writes as json text messages
+
+    Writes go straight into the DMX universe, without a round trip to the Hue bridge. The next
+    Hue event for a fixture overwrites its channels again, so Hue remains leading.
+    """
+    controller: 'DmxController'
+    host: str
+    port: int
+    logger: Logger
+
+    def __init__(self, controller: 'DmxController', host: str, port: int, logger: Logger):
+        self.controller = controller
+        self.host = host
+        self.port = port
+        self.logger = logger
+        self._loop = None
+        self._streams: Dict[Any, asyncio.Queue] = {}  # websocket -> queue holding the latest frame only
+
+    def start(self):
+        from aiohttp import web  # optional dependency, only needed when the API is enabled
+
+        ready = threading.Event()
+
+        def serve():
+            try:
+                asyncio.run(self._serve(web, ready))
+            except Exception as e:
+                self.logger.error(f"Control API stopped: {e}")
+                ready.set()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+
+    async def _serve(self, web, ready: threading.Event):
+        app = web.Application()
+        app.add_routes([
+            web.get("/state", self._get_state),
+            web.put("/channels", self._put_channels),
+            web.put("/fixtures/{name}", self._put_fixture),
+            web.get("/ws", self._stream),
+        ])
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        self._loop = asyncio.get_running_loop()
+        self.controller.dmx_sender.add_frame_listener(self._on_frame)
+        self.logger.info(f"Control API listening on http://{self.host}:{self.port}")
+        ready.set()
+        await asyncio.Event().wait()
+
+    def _universe(self) -> bytes:
+        return bytes(self.controller.dmx_sender.dmx_data)
+
+    def _write(self, address: int, data: bytes):
+        self.controller.dmx_sender.send_messages([(address, data)])
+
+    async def _in_executor(self, function, *args):
+        """Runs a call that may block off the event loop: the sender lock is held while a frame is
+        written, and frame timing of the output process takes a pipe round trip."""
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def _get_state(self, request):
+        from aiohttp import web
+
+        universe = self._universe()
+        fixtures: List[Dict[str, Any]] = [{
+            "name": f.name,
+            "class": type(f).__name__,
+            "hue_bridge": f.hue_bridge_id,
+            "hue_id": f.hue_light_id,
+            "dmx_address": f.dmx_address,
+            "values": list(universe[f.dmx_address:f.dmx_address + f.num_channels]),
+        } for f in self.controller.dmx_fixtures]
+        return web.json_response({
+            "fixtures": fixtures,
+            "universe": list(universe[1:]),
+            "timing": await self._in_executor(self.controller.dmx_sender.frame_timing),
+            # replay bridges send no requests, so they have no scheduler
+            "hue_requests": {bridge_id: bridge.scheduler.metrics()
+                             for bridge_id, bridge in self.controller.hue_bridges.items() if hasattr(bridge, "scheduler")},
+        })
+
+    async def _put_channels(self, request):
+        from aiohttp import web
+
+        try:
+            await self._in_executor(self._write, *parse_channel_write(await request.json()))
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        return web.json_response({"ok": True})
+
+    async def _put_fixture(self, request):
+        from aiohttp import web
+
+        name = request.match_info["name"]
+        fixture = next((f for f in self.controller.dmx_fixtures if f.name == name), None)
+        if fixture is None:
+            return web.json_response({"error": f"unknown fixture '{name}'"}, status=404)
+        try:
+            body = await request.json()
+            values = body.get("values") if isinstance(body, dict) else None
+            await self._in_executor(self._write, *parse_channel_write(
+                {"address": fixture.dmx_address, "values": values}, max_channels=fixture.num_channels))
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        return web.json_response({"ok": True})
+
+    async def _stream(self, request):
+        from aiohttp import WSMsgType, web
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        queue = asyncio.Queue(maxsize=1)
+        queue.put_nowait(self._universe())
+        self._streams[ws] = queue
+
+        async def send_frames():
+            while True:
+                frame = await queue.get()
+                await ws.send_bytes(frame[1:])
+
+        sender = asyncio.create_task(send_frames())
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    await self._in_executor(self._write, *parse_channel_write(json.loads(message.data)))
+                except ValueError as e:  # includes invalid json
+                    await ws.send_json({"error": str(e)})
+        finally:
+            sender.cancel()
+            del self._streams[ws]
+        return ws
+
+    def _on_frame(self, frame: bytes):
+        """Called from the DMX output thread for every frame sent."""
+        if self._streams:
+            self._loop.call_soon_threadsafe(self._publish, frame)
+
+    def _publish(self, frame: bytes):
+        for queue in self._streams.values():
+            if queue.full():
+                queue.get_nowait()  # a slow client only gets the latest frame
+            queue.put_nowait(frame)
@@ -7,10 +7,13 @@ from DmxFixture import DmxFixture
 
 
 class Dmx1ChDimmable(DmxFixture):
+    __slots__ = ()
+    num_channels = 1
 
-    def get_dmx_message(self) -> bytes:
+    def render(self, universe: memoryview):
         if not self.hueLamp.on.on:
-            return bytes([0])
+            universe[self.dmx_address] = 0
+            return
 
         dim_level = math.ceil(self.hueLamp.dimming.brightness)
         if dim_level > 255:
@@ -18,4 +21,4 @@ class Dmx1ChDimmable(DmxFixture):
         if dim_level < 0:
             dim_level = 0
 
-        return bytes([dim_level])
+        universe[self.dmx_address] = dim_level
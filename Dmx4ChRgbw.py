@@ -1,44 +1,54 @@
 """
 Copyright (c) 2023 Tom Kalmijn / MIT License.
 """
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 import kelvin_rgb
-from ColorConverter import Converter, XYPoint
+from ColorConverter import Converter
 from DmxFixture import DmxFixture
+from HueGamutRegistry import gamut_registry
 
 
 class Dmx4ChRgbw(DmxFixture):
+    __slots__ = ("converter", "converter_generation")
+    num_channels = 4
     kelvin_white_led = 5000
 
-    def get_dmx_message(self) -> bytes:
+    converter: Optional[Converter]
+    converter_generation: int
+
+    def __init__(self, name: str, hue_light_id: str, dmx_address: int, hue_bridge_id: str = "1"):
+        super().__init__(name, hue_light_id, dmx_address, hue_bridge_id)
+        self.converter = None
+        self.converter_generation = -1
+
+    def render(self, universe: memoryview):
+        address = self.dmx_address
 
         if not self.hueLamp.on.on:
-            return bytes([0, 0, 0, 0])
+            universe[address:address + 4] = b"\0\0\0\0"
+            return
 
         dim_factor = self.hueLamp.dimming.brightness / 100
 
-        if self.hueLamp.color.gamut_type == 'other':
-            raise Exception(f"No gamut info for {self.name}, tracking Hue lamp {self.hue_light_id}")
+        # the converter for the gamut of the lamp is only looked up again when the registry changed
+        if self.converter_generation != gamut_registry.generation:
+            self.converter = gamut_registry.converter_for(self.hue_key, self.hueLamp)
+            self.converter_generation = gamut_registry.generation
 
-        gamut = (
-            XYPoint(self.hueLamp.color.gamut.red.x, self.hueLamp.color.gamut.red.y),
-            XYPoint(self.hueLamp.color.gamut.green.x, self.hueLamp.color.gamut.green.y),
-            XYPoint(self.hueLamp.color.gamut.blue.x, self.hueLamp.color.gamut.blue.y),
-        )
         x = self.hueLamp.color.xy.x
         y = self.hueLamp.color.xy.y
 
         # convert Hue gamut coordinates to r g b
-        color_converter = Converter(gamut)
-        r, g, b = color_converter.xy_to_rgb(x, y)
+        r, g, b = self.converter.xy_to_rgb(x, y)
 
         # apply dimming level
         r, g, b = r * dim_factor, g * dim_factor, b * dim_factor
 
         # convert to rgbw
         (r, g, b, w) = self.rgb_to_rgbw(r, g, b)
-        return bytes([r, g, b, w])
+        # a single assignment, so a fixture that does not fit the universe writes no channel at all
+        universe[address:address + 4] = bytes((r, g, b, w))
 
     def rgb_to_rgbw(self, r, g, b):
         k_white_red = kelvin_rgb.kelvin_table[self.kelvin_white_led][0]
@@ -0,0 +1,88 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import threading
+from logging import Logger
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from DmxFixture import DmxFixture, render_fixtures
+from DmxOutputScheduler import DmxOutputScheduler
+
+
+class DmxFrameSource:
+    """Calls frame listeners with each frame sent, e.g. to stream the universe to the control API."""
+    logger: Logger
+
+    def __init__(self, logger: Logger):
+        self.logger = logger
+        self.frame_listeners: List[Callable[[bytes], None]] = []  # called with each frame sent
+
+    def add_frame_listener(self, listener: Callable[[bytes], None]):
+        self.frame_listeners.append(listener)
+
+    def _notify_frame_listeners(self, frame: bytes):
+        for listener in self.frame_listeners:
+            try:
+                listener(frame)
+            except Exception as e:
+                self.logger.error("Error in DMX frame listener: %s", e)
+
+
+class DmxBufferedSender(DmxFrameSource):
+    """Base class of the output backends that buffer the universe and send it from a DmxOutputScheduler.
+
+    dmx_data holds one start byte (0x00) plus 512 bytes of channel data. According to DMX512 the
+    untouched channels are repeated with every frame, so dmx_data is the authoritative state of the
+    universe: messages and fixtures only update it, and the scheduler sends it in the next frame.
+    Fixtures render straight into dmx_data through a memoryview. Subclasses implement _send_frame.
+    """
+    dmx_data: bytearray
+    scheduler: DmxOutputScheduler
+
+    def __init__(self, logger: Logger, frame_rate: float = 0):
+        super().__init__(logger)
+        self.dmx_data = bytearray(513)  # filled with zeros, which incidentally sets the start byte
+        self.universe = memoryview(self.dmx_data)
+        self.lock = threading.Lock()
+        self.scheduler = DmxOutputScheduler(send_frame=self._output_frame, frame_rate=frame_rate, logger=logger)
+
+    def send_message(self, address: int, data: bytes):
+        self.send_messages([(address, data)])
+
+    def send_messages(self, messages: List[Tuple[int, bytes]]):
+        """Writes the data of several fixtures into the buffer and sends them as a single packet."""
+        with self.lock:
+            for address, data in messages:
+                # address equals offset because DMX addresses start with 1 skipping the start byte in the data packet.
+                self.dmx_data[address:address + len(data)] = data
+        self.send_buffer()
+
+    def send_fixtures(self, fixtures: Iterable[DmxFixture], messages: Iterable[Tuple[int, bytes]] = ()):
+        """Writes messages into the buffer, renders fixtures straight into it and sends all as a single packet."""
+        with self.lock:
+            for address, data in messages:
+                self.dmx_data[address:address + len(data)] = data
+            render_fixtures(fixtures, self.universe, self.logger)
+        self.send_buffer()
+
+    def send_buffer(self):
+        """Requests the buffered channels of all fixtures to be sent in the next frame."""
+        self.scheduler.request_frame()
+
+    def frame_timing(self) -> Dict[str, float]:
+        """Returns the period and jitter of recent frames."""
+        return self.scheduler.frame_timing()
+
+    def _output_frame(self) -> bool:
+        """Sends the buffered universe from the scheduler thread and hands it to the frame listeners."""
+        with self.lock:
+            if not self._send_frame():
+                return False
+            frame = bytes(self.dmx_data) if self.frame_listeners else b''
+        if frame:
+            self._notify_frame_listeners(frame)
+        return True
+
+    def _send_frame(self) -> bool:
+        """Sends dmx_data, called with the lock held. Returns whether the frame was sent."""
+        raise NotImplementedError
@@ -1,34 +1,61 @@
-import json
 import logging
 import os
+import re
 import threading
 import time
 import collections
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
 from dotenv import load_dotenv
 
+from AsyncLogging import JsonFormatter, LazyJson, LogSampler, start_queue_logging
 from DmxFixture import DmxFixture
-from DmxSender import DmxSender
+from DmxOutputScheduler import MIN_FRAME_PERIOD_SEC
+from FixtureConfig import FixtureConfigWatcher, FixtureSpec, create_fixture, fixture_spec, load_fixture_specs
 from HueBridge import HueBridge
+from HueButtonRoutes import HueButtonRoutes
+from HueEventLog import (RECORDED_RESOURCE_TYPES, HueEventRecorder, HueEventReplay, HueReplayBridge,
+                         parse_replay_speed)
+from HueGamutRegistry import gamut_registry
+from HueGroupIndex import HueGroupIndex
+from HueHeartbeat import HueHeartbeat
+from HueRequestScheduler import PRIORITY_RESYNC
 
-test_mode = os.getenv('STUB_DMX', 'false').lower() == 'true'
+if TYPE_CHECKING:
+    from DmxOutputProcess import DmxProcessSender
+    from DmxSender import DmxSender
+    from DmxStubSender import DmxStubSender
+    from HueModel import HueLight
+
+HueKey = Tuple[str, str]  # (bridge id, light id)
 
 
 class DmxController:
     DEBOUNCE_DELAY = 0.2  # 200 milliseconds debounce delay
-    MAX_CONCURRENT_UPDATES = 5  # Limit to 5 simultaneous updates
 
     def __init__(self):
         self.running_as_service = os.getenv('RUNNING_AS_SERVICE', 'false').lower() == 'true'
         self._load_env()
+        self.test_mode = os.getenv('STUB_DMX', 'false').lower() == 'true'
         self.logger = self._init_logger()
-        self.dmx_fixtures: List[DmxFixture] = []
-        self.dmx_sender: Optional[DmxSender] = None
-        self.hue_bridge: Optional[HueBridge] = None
-
-        self.update_queue = collections.deque()  # FIFO queue for updates
+        self.event_log_sampler = LogSampler(int(os.getenv('HUE_EVENT_LOG_PER_SEC', 5)))
+        self.dmx_fixtures: List[DmxFixture] = []  # replaced as a whole on reload, never modified in place
+        self.fixture_config_watcher: Optional[FixtureConfigWatcher] = None
+        self.reload_lock = threading.Lock()
+        self.dmx_sender: Optional['DmxSender | DmxStubSender | DmxProcessSender'] = None
+        self.hue_bridges: Dict[str, 'HueBridge | HueReplayBridge'] = {}  # by id, the first is the default bridge
+        self.group_indexes: Dict[str, HueGroupIndex] = {}
+        self.button_routes: Dict[str, HueButtonRoutes] = {}
+        self.heartbeats: Dict[str, HueHeartbeat] = {}
+        self.event_recorder: Optional[HueEventRecorder] = None
+        self.event_replay: Optional[HueEventReplay] = None
+
+        self.update_queue = collections.deque()  # FIFO queue of HueKey batches, each rendered as one DMX packet
         self.update_lock = threading.Lock()
-        self.semaphore = threading.Semaphore(self.MAX_CONCURRENT_UPDATES)  # Limit concurrency
+        self.pending_updates = 0  # batches queued or being processed
+        # as many batches at a time as a Hue bridge takes requests at a time, the rest waits in the queue
+        self.update_workers = ThreadPoolExecutor(max_workers=int(os.getenv('HUE_MAX_CONCURRENT_REQUESTS', 5)),
+                                                 thread_name_prefix="fixture-updates")
 
         self._initialize()
 
@@ -40,167 +67,538 @@ class DmxController:
 
     @staticmethod
     def _init_logger():
-        """Initializes and returns the logger."""
+        """Initializes and returns the logger.
+
+        Messages are formatted and written by a background thread, so a slow console or SD card does
+        not hold up the threads handling Hue events. With LOG_FORMAT=json the log file gets one json
+        object per line, including timing fields.
+        """
         logger = logging.getLogger("DmxController")
-        logger.setLevel(logging.INFO)
+        log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+        valid_level = isinstance(logging.getLevelName(log_level), int)
+        logger.setLevel(log_level if valid_level else logging.INFO)
         log_file = os.getenv('LOG_FILE', 'dmx_controller.log')
 
         console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
         file_handler = logging.FileHandler(log_file)
-        file_handler.setLevel(logging.INFO)
-        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-
-        logger.addHandler(console_handler)
-        logger.addHandler(file_handler)
+        if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+        start_queue_logging(logger, [console_handler, file_handler])
+        if not valid_level:
+            logger.error(f"Invalid LOG_LEVEL '{log_level}', using INFO")
         return logger
 
     def _initialize(self):
-        """Initializes DMX fixtures, DMX sender, and the Hue bridge connection."""
+        """Initializes DMX fixtures, DMX sender, and the Hue bridge connection.
+
+        Only what is needed to start listening for Hue events is done before returning. Probing the
+        DMX output, validating fixtures and indexing groups, buttons and gamuts run concurrently in the
+        background. Until the DMX output is found, frames are buffered.
+        """
+        self._startup_phase("init Hue bridges", self._init_hue_bridges)
+        self._startup_phase("load fixtures", self._init_fixtures)
+        self._startup_phase("load Hue gamuts",
+                            lambda: gamut_registry.load(os.getenv('GAMUT_CACHE_FILE', 'hue-gamuts.json'), self.logger))
+        self._startup_phase("init DMX sender", self._init_dmx_sender)
+
+        if not self.test_mode:
+            self._startup_phase("probe DMX output", self.dmx_sender.connect, background=True)
+        if os.getenv('CONTROL_API_PORT'):
+            self._startup_phase("start control API", self._start_control_api)
+        for bridge_id in self.hue_bridges:
+            self._startup_phase(f"validate fixtures of bridge {bridge_id}",
+                                lambda b=bridge_id: self._validate_fixtures(b), background=True)
+            self._startup_phase(f"index groups of bridge {bridge_id}",
+                                self.group_indexes[bridge_id].refresh_until_done, background=True)
+            self._startup_phase(f"route buttons of bridge {bridge_id}",
+                                self.button_routes[bridge_id].refresh_until_done, background=True)
+            self._startup_phase(f"index gamuts of bridge {bridge_id}",
+                                lambda b=bridge_id: gamut_registry.refresh(self.hue_bridges[b]), background=True)
+
+    def _startup_phase(self, name: str, phase: Callable[[], None], background: bool = False):
+        """Runs a startup phase and logs how long it took, errors are logged but not fatal."""
+        def run():
+            started = time.monotonic()
+            try:
+                phase()
+            except Exception as e:
+                self.logger.error("Startup phase '%s' failed: %s", name, e)
+            took_ms = (time.monotonic() - started) * 1000
+            self.logger.info("Startup phase '%s' took %.0f ms", name, took_ms, extra={"timing": {"phase_ms": round(took_ms, 3)}})
+
+        if background:
+            threading.Thread(target=run, daemon=True).start()
+        else:
+            run()
+
+    def _init_fixtures(self):
         self.logger.info("Loading DMX fixtures")
         self.dmx_fixtures = self._load_dmx_fixtures()
 
-        self.logger.info("Initializing DMX sender")
-        self.dmx_sender = DmxSender(logger=self.logger)
+    def _init_dmx_sender(self):
+        if os.getenv('DMX_OUTPUT_PROCESS', 'false').lower() == 'true':
+            from DmxOutputProcess import DmxProcessSender
+
+            self.logger.info("Starting DMX output process")
+            self.dmx_sender = DmxProcessSender(test_mode=self.test_mode, logger=self.logger)
+        else:
+            from DmxOutputProcess import create_dmx_sender
 
-        self.logger.info("Connecting to Hue bridge")
-        self.hue_bridge = HueBridge(
-            bridge_ip=os.getenv('HUE_BRIDGE_IP'),
-            api_key=os.getenv('HUE_API_KEY'),
-            timeout_sec=int(os.getenv('HUE_TIMEOUT_SEC', 240)),
+            self.dmx_sender = create_dmx_sender(test_mode=self.test_mode, logger=self.logger)
+
+    def _start_control_api(self):
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError:
+            self.logger.error("CONTROL_API_PORT requires the aiohttp package: pip install aiohttp")
+            return
+        from ControlApi import ControlApi
+
+        ControlApi(
+            controller=self,
+            host=os.getenv('CONTROL_API_HOST', '127.0.0.1'),
+            port=int(os.getenv('CONTROL_API_PORT')),
             logger=self.logger
-        )
-        self._validate_fixtures()
+        ).start()
+
+    def _init_hue_bridges(self):
+        """Creates a connection per bridge: HUE_BRIDGE<n>_IP and HUE_BRIDGE<n>_API_KEY, with bridge id n.
+
+        HUE_BRIDGE_IP and HUE_API_KEY configure bridge 1. When replaying, each bridge is replaced by a
+        HueReplayBridge serving the recorded state, so the bridges are not contacted at all.
+        """
+        replay_file = os.getenv('HUE_EVENT_REPLAY_FILE')
+        bridge_configs = {}
+        if os.getenv('HUE_BRIDGE_IP'):
+            bridge_configs["1"] = (os.getenv('HUE_BRIDGE_IP'), os.getenv('HUE_API_KEY'))
+        numbers = sorted(int(match.group(1)) for match in (re.fullmatch(r"HUE_BRIDGE(\d+)_IP", key) for key in os.environ)
+                         if match)
+        for i in numbers:
+            bridge_configs[str(i)] = (os.getenv(f"HUE_BRIDGE{i}_IP"), os.getenv(f"HUE_BRIDGE{i}_API_KEY"))
+        if not bridge_configs:
+            if not replay_file:
+                self.logger.error("No Hue bridge configured, set HUE_BRIDGE_IP and HUE_API_KEY")
+            bridge_configs["1"] = (None, None)
+
+        for bridge_id, (bridge_ip, api_key) in bridge_configs.items():
+            if replay_file:
+                hue_bridge = HueReplayBridge(bridge_id, self.logger)
+            else:
+                self.logger.info(f"Connecting to Hue bridge {bridge_id} at {bridge_ip}")
+                hue_bridge = HueBridge(
+                    bridge_ip=bridge_ip,
+                    api_key=api_key,
+                    timeout_sec=int(os.getenv('HUE_TIMEOUT_SEC', 240)),
+                    logger=self.logger,
+                    bridge_id=bridge_id,
+                    requests_per_sec=float(os.getenv('HUE_REQUESTS_PER_SEC', 10)),
+                    max_concurrent_requests=int(os.getenv('HUE_MAX_CONCURRENT_REQUESTS', 5))
+                )
+            self.hue_bridges[bridge_id] = hue_bridge
+            # group events fall back to their individual light events until the index is built
+            self.group_indexes[bridge_id] = HueGroupIndex(hue_bridge, self.logger)
+            # unrouted buttons refresh all fixtures until the routes are built
+            self.button_routes[bridge_id] = HueButtonRoutes(hue_bridge, self.group_indexes[bridge_id], self.logger)
+
+        record_file = os.getenv('HUE_EVENT_RECORD_FILE')
+        if record_file:
+            self.logger.info(f"Recording Hue bridge events to {record_file}")
+            self.event_recorder = HueEventRecorder(record_file)
+            for bridge_id, hue_bridge in self.hue_bridges.items():
+                try:
+                    self.event_recorder.record_resources(bridge_id, {
+                        resource_type: hue_bridge.get_resources(resource_type)
+                        for resource_type in RECORDED_RESOURCE_TYPES
+                    })
+                except Exception as e:
+                    self.logger.error(f"Cannot record the resources of Hue bridge {bridge_id}, "
+                                      f"the recording cannot be replayed without it: {e}")
+
+        if replay_file:
+            self.event_replay = HueEventReplay(
+                path=replay_file,
+                speed=parse_replay_speed(os.getenv('HUE_EVENT_REPLAY_SPEED', '1')),
+                default_bridge_id=self.default_bridge_id,
+                bridges=self.hue_bridges,
+                logger=self.logger
+            )
+            self.event_replay.load()
+
+    @property
+    def default_bridge_id(self) -> str:
+        return next(iter(self.hue_bridges))
 
     def _load_dmx_fixtures(self) -> List[DmxFixture]:
-        """Loads and returns a list of DMX fixtures from environment variables."""
+        """Loads and returns a list of DMX fixtures from the fixtures file or environment variables."""
+        fixtures_file = os.getenv('FIXTURES_FILE')
+        if fixtures_file:
+            self.fixture_config_watcher = FixtureConfigWatcher(
+                path=fixtures_file,
+                interval_sec=float(os.getenv('FIXTURES_POLL_SEC', 2)),
+                default_bridge_id=self.default_bridge_id,
+                logger=self.logger
+            )
+            specs = self.fixture_config_watcher.load()
+        else:
+            specs = load_fixture_specs(os.environ, self.default_bridge_id, self.logger)
+
         result = []
-        try:
-            i = 1
-            while True:
-                name = os.getenv(f"FIXTURE{i}_NAME")
-                hue_id = os.getenv(f"FIXTURE{i}_HUE_ID")
-                dmx_address = int(os.getenv(f"FIXTURE{i}_DMX_ADDRESS", "0"))
-                class_name = os.getenv(f"FIXTURE{i}_CLASS")
-                if name and hue_id and dmx_address and class_name:
-                    self.logger.info(f"    {name}: dmx_address={dmx_address}, hue_id={hue_id}")
-                    module = __import__(class_name)
-                    dmx_fixture_sub_class = getattr(module, class_name)
-                    fixture = dmx_fixture_sub_class(name, hue_id, dmx_address)
-                    result.append(fixture)
-                    i += 1
-                else:
-                    break
-        except Exception as e:
-            self.logger.error(f"Error loading DMX fixtures: {e}")
+        for spec in specs.values():
+            if spec.bridge_id not in self.hue_bridges:
+                self.logger.error(f"Hue bridge {spec.bridge_id} of fixture '{spec.name}' is not configured.")
+                continue
+            try:
+                fixture = create_fixture(spec)
+                self.logger.info(f"    {spec.name}: dmx_address={spec.dmx_address}, hue_id={spec.hue_id}, "
+                                 f"hue_bridge={spec.bridge_id}")
+                result.append(fixture)
+            except Exception as e:
+                self.logger.error(f"Error loading DMX fixture {spec.name}: {e}")
         return result
 
-    def send_heartbeat(self):
-        """Sends periodic updates to the Hue bridge to prevent timeouts."""
-        def heartbeat():
-            while True:
+    def watch_fixtures(self):
+        """Applies changes to FIXTURES_FILE while running, without restarting the service."""
+        if self.fixture_config_watcher:
+            self.logger.info(f"Watching {self.fixture_config_watcher.path} for fixture changes")
+            self.fixture_config_watcher.start(self._apply_fixture_specs)
+
+    def _apply_fixture_specs(self, specs: Dict[str, FixtureSpec]):
+        """Replaces added, removed and changed fixtures and sends their channels in a single DMX packet.
+
+        Unaffected fixtures are kept as they are, including their Hue light state. Light state is only
+        fetched for Hue lights that no running fixture is tracking yet.
+        """
+        with self.reload_lock:
+            running = {fixture.name: fixture for fixture in self.dmx_fixtures}
+            removed = [fixture for name, fixture in running.items() if fixture_spec(fixture) != specs.get(name)]
+            added = [spec for name, spec in specs.items() if name not in running or fixture_spec(running[name]) != spec]
+            if not removed and not added:
+                self.logger.info("Fixture configuration has no changes")
+                return
+
+            hue_lights = {f.hue_key: f.hueLamp for f in self.dmx_fixtures if hasattr(f, 'hueLamp')}
+            unknown_keys = [(spec.bridge_id, spec.hue_id) for spec in added
+                            if spec.bridge_id in self.hue_bridges and (spec.bridge_id, spec.hue_id) not in hue_lights]
+            hue_lights.update(self._get_lights(unknown_keys))
+
+            new_fixtures = {}
+            for spec in added:
+                if spec.bridge_id not in self.hue_bridges:
+                    self.logger.error(f"Hue bridge {spec.bridge_id} of fixture '{spec.name}' is not configured.")
+                    continue
+                if (spec.bridge_id, spec.hue_id) not in hue_lights:
+                    self.logger.error(f"Hue ID for fixture '{spec.name}' cannot be found.")
+                    continue
                 try:
-                    hue_id = os.getenv("FIXTURE1_HUE_ID")
-                    if not hue_id:
-                        self.logger.warning("No Hue ID specified for heartbeat.")
-                        return
-
-                    hue_light = self.hue_bridge.get_light(hue_id)
-                    function = "unknown" if hue_light.metadata.function == "mixed" else "mixed"
-                    self.hue_bridge.set_light_state(hue_id, {"metadata": {"function": function}})
+                    fixture = create_fixture(spec)
+                    fixture.hueLamp = hue_lights[fixture.hue_key]
+                    new_fixtures[spec.name] = fixture
                 except Exception as e:
-                    self.logger.error("Error sending heartbeat to Hue bridge: %s", e)
+                    self.logger.error(f"Error loading DMX fixture {spec.name}: {e}")
+
+            fixtures = []
+            for name in specs:
+                if name in new_fixtures:
+                    fixtures.append(new_fixtures[name])
+                elif name in running and running[name] not in removed:
+                    fixtures.append(running[name])
+
+            # blank the channels of removed fixtures, restoring kept fixtures that share any of them
+            messages = [(f.dmx_address, bytes(f.num_channels)) for f in removed]
+            blanked = {f.dmx_address + i for f in removed for i in range(f.num_channels)}
+            rendered = [f for f in fixtures if f.name not in new_fixtures and hasattr(f, 'hueLamp') and
+                        blanked.intersection(range(f.dmx_address, f.dmx_address + f.num_channels))]
+            rendered.extend(new_fixtures.values())
+
+            self.dmx_fixtures = fixtures
+            if self.test_mode:
+                self.logger.info(f"Update {', '.join(new_fixtures) or 'none'}")
+            if messages or rendered:
+                self.dmx_sender.send_fixtures(rendered, messages)
+
+            self.logger.info(f"Reloaded fixtures: {len(removed)} removed or changed, {len(new_fixtures)} added or changed")
 
-                time.sleep(180)  # Every 3 minutes
-
-        threading.Thread(target=heartbeat, daemon=True).start()
-
-    def _validate_fixtures(self):
-        """Validates that all DMX fixtures are mapped to existing Hue lights."""
-        hue_bulbs = self.hue_bridge.list_light_ids_and_names()
-        for fixture in self.dmx_fixtures:
-            if fixture.hue_light_id not in hue_bulbs:
-                self.logger.error(f"Hue ID for fixture '{fixture.name}' cannot be found.")
-                self.logger.info("Valid IDs:")
-                for key, value in hue_bulbs.items():
-                    self.logger.info(f"    {key}: {value}")
-                exit(1)
+    def send_heartbeat(self):
+        """Sends updates to each Hue bridge when its event stream is idle, to prevent timeouts."""
+        if self.event_replay:
+            return  # replayed events do not come from the bridge, so there is no stream to keep alive
+
+        for bridge_id, hue_bridge in self.hue_bridges.items():
+            hue_id = next((f.hue_light_id for f in self.dmx_fixtures if f.hue_bridge_id == bridge_id), None)
+            if not hue_id:
+                self.logger.warning(f"No Hue ID specified for heartbeat of bridge {bridge_id}.")
+                continue
+
+            def get_cached_light(key=(bridge_id, hue_id)):
+                return next((f.hueLamp for f in self.dmx_fixtures if f.hue_key == key and hasattr(f, 'hueLamp')), None)
+
+            self.heartbeats[bridge_id] = HueHeartbeat(
+                hue_bridge=hue_bridge,
+                hue_light_id=hue_id,
+                interval_sec=float(os.getenv('HUE_HEARTBEAT_SEC', 180)),
+                get_cached_light=get_cached_light,
+                logger=self.logger
+            )
+            self.heartbeats[bridge_id].start()
+
+    def _validate_fixtures(self, bridge_id: str):
+        """Validates that the DMX fixtures of a bridge are mapped to existing Hue lights and sends their current state.
+
+        Fixtures tracking an unknown Hue light are dropped.
+        """
+        hue_lights = self.hue_bridges[bridge_id].get_lights(PRIORITY_RESYNC)
+        with self.reload_lock:
+            fixtures = []
+            rendered = []
+            for fixture in self.dmx_fixtures:
+                if fixture.hue_bridge_id != bridge_id:
+                    fixtures.append(fixture)
+                    continue
+                if fixture.hue_light_id not in hue_lights:
+                    self.logger.error(f"Hue ID for fixture '{fixture.name}' cannot be found on bridge {bridge_id}.")
+                    self.logger.info("Valid IDs:")
+                    for key, value in hue_lights.items():
+                        self.logger.info(f"    {key}: {value.metadata.name}")
+                    continue
+                fixtures.append(fixture)
+                fixture.hueLamp = hue_lights[fixture.hue_light_id]
+                rendered.append(fixture)
+
+            self.dmx_fixtures = fixtures
+            if rendered:
+                self.dmx_sender.send_fixtures(rendered)
+
+    def _get_lights(self, keys: Iterable[HueKey]) -> Dict[HueKey, 'HueLight']:
+        """Fetches the state of Hue lights, with a single request per bridge.
+
+        Lights that cannot be fetched (e.g. an unknown light id) are logged and left out of the result.
+        """
+        light_ids: Dict[str, List[str]] = {}
+        for bridge_id, light_id in keys:
+            light_ids.setdefault(bridge_id, []).append(light_id)
+
+        result = {}
+        for bridge_id, ids in light_ids.items():
+            hue_bridge = self.hue_bridges[bridge_id]
+            try:
+                if len(ids) == 1:
+                    result[(bridge_id, ids[0])] = hue_bridge.get_light(ids[0])
+                else:
+                    # one request instead of one per light
+                    result.update(((bridge_id, light_id), light)
+                                  for light_id, light in hue_bridge.get_lights().items())
+            except Exception as e:
+                self.logger.error("Cannot fetch Hue light %s from bridge %s: %s", ", ".join(ids), bridge_id, e)
+        return result
 
-    def _schedule_updates(self, changed_hue_ids: List[str]):
-        """Adds updates to the queue while ensuring controlled processing."""
+    def _schedule_updates(self, batches: List[Tuple[HueKey, ...]]):
+        """Adds update batches to the queue while ensuring controlled processing."""
         with self.update_lock:
-            for hue_id in changed_hue_ids:
-                if hue_id not in self.update_queue:
-                    self.update_queue.append(hue_id)
-
-        threading.Thread(target=self._process_updates, daemon=True).start()
-
-    def _process_updates(self):
-        """Processes the update queue while ensuring only 5 concurrent updates."""
-        while True:
-            with self.update_lock:
-                if not self.update_queue:
-                    break
-
-                fixture_id = self.update_queue.popleft()
-
-            self.semaphore.acquire()
-            threading.Thread(target=self._update_fixture, args=(fixture_id,), daemon=True).start()
+            for batch in batches:
+                queued = set().union(*self.update_queue)
+                if not queued.issuperset(batch):
+                    self.update_queue.append(batch)
+                    self.pending_updates += 1
+                    self.update_workers.submit(self._process_update)
+
+    def _process_update(self):
+        """Processes the oldest batch of the update queue, on a worker of the update pool.
+
+        Batches wait in the queue until a worker is free, so a burst of events does not start a thread
+        per batch. The request scheduler of each Hue bridge collapses requests of concurrent batches
+        for the same light.
+        """
+        with self.update_lock:
+            batch = self.update_queue.popleft()  # one task is submitted per queued batch
+        self._update_fixtures(batch)
 
-    def _update_fixture(self, fixture_id: str):
-        """Updates a single fixture and releases the semaphore when done."""
+    def _update_fixtures(self, hue_keys: Tuple[HueKey, ...]):
+        """Updates the fixtures of a batch in one DMX packet."""
+        started = time.perf_counter()
         try:
-            fixture = next(f for f in self.dmx_fixtures if f.hue_light_id == fixture_id)
-            fixture.hueLamp = self.hue_bridge.get_light(fixture.hue_light_id)
-            dmx_message = fixture.get_dmx_message()
+            fixtures = [f for f in self.dmx_fixtures if f.hue_key in hue_keys]
+            if not fixtures:
+                self.logger.warning("Fixture with Hue ID %s not found.", ", ".join(key[1] for key in hue_keys))
+                return
+
+            hue_lights = self._get_lights(hue_keys)
+            fetched = time.perf_counter()
+
+            rendered = []
+            for fixture in fixtures:
+                if fixture.hue_key in hue_lights:
+                    fixture.hueLamp = hue_lights[fixture.hue_key]
+                    rendered.append(fixture)
+                else:
+                    self.logger.error("Error updating fixture %s: no state received from the Hue bridge", fixture.name)
 
-            if test_mode:
-                self.logger.info(f"Update {fixture.name}")
-            else:
-                self.dmx_sender.send_message(fixture.dmx_address, dmx_message)
+            if self.test_mode:
+                self.logger.info("Update %s", ", ".join(f.name for f in fixtures))
+            if rendered:
+                self.dmx_sender.send_fixtures(rendered)
 
-        except StopIteration:
-            self.logger.warning(f"Fixture with Hue ID {fixture_id} not found.")
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Updated %d fixtures", len(rendered), extra={"timing": {
+                    "fetch_ms": round((fetched - started) * 1000, 3),
+                    "render_ms": round((time.perf_counter() - fetched) * 1000, 3),
+                    "total_ms": round((time.perf_counter() - started) * 1000, 3),
+                }})
 
         except Exception as e:
-            self.logger.error(f"Error updating fixture {fixture_id}: {e}")
+            self.logger.error("Error updating fixtures %s: %s", ", ".join(key[1] for key in hue_keys), e)
 
         finally:
-            self.semaphore.release()
+            with self.update_lock:
+                self.pending_updates -= 1
 
     def track_and_update_fixtures(self):
-        """Listens for Hue bridge events and synchronizes updates with DMX fixtures."""
+        """Listens for the events of all Hue bridges and synchronizes updates with DMX fixtures.
+
+        With HUE_EVENT_REPLAY_FILE set, recorded events are processed instead and this method returns
+        when all of them have been rendered.
+        """
+        if self.event_replay:
+            self.logger.info(f"Replaying Hue bridge events from {self.event_replay.path}...")
+            for bridge_id, event in self.event_replay.event_stream():
+                self._process_event(bridge_id, event)
+            self._wait_for_updates()
+            time.sleep(2 * MIN_FRAME_PERIOD_SEC)  # the last update may wait for the next frame
+            return
+
         self.logger.info("Start listening for Hue bridge events...")
+        listeners = [threading.Thread(target=self._listen, args=(bridge_id,), daemon=True)
+                     for bridge_id in self.hue_bridges]
+        for listener in listeners:
+            listener.start()
+        for listener in listeners:
+            listener.join()
+
+    def _listen(self, bridge_id: str):
+        """Processes the event stream of a Hue bridge, reconnecting when the stream is lost."""
+        delay_sec = 1
         while True:
-            for event in self.hue_bridge.event_stream():
-                if event["type"] == "update":
-                    if not self.running_as_service:
-                        self.logger.info(json.dumps(event, indent=4))
-
-                    if self._contains_button_short_release(event):
-                        changed_hue_ids = [fixture.hue_light_id for fixture in self.dmx_fixtures]
-                    else:
-                        changed_hue_ids = [obj["id"] for obj in event.get("data", []) if "id" in obj]
-
-                    self._schedule_updates(changed_hue_ids)
-
-            time.sleep(60)  # Retry connection every minute if disconnected
+            try:
+                for event in self.hue_bridges[bridge_id].event_stream():
+                    self._process_event(bridge_id, event)
+                delay_sec = 1
+            except Exception as e:
+                self.logger.error("Cannot connect to Hue bridge %s: %s", bridge_id, e)
+            time.sleep(delay_sec)  # Retry connection, backing off to once a minute
+            delay_sec = min(delay_sec * 2, 60)
+
+    def _process_event(self, bridge_id: str, event: dict):
+        """Schedules the fixture updates for a Hue event."""
+        if bridge_id not in self.hue_bridges:
+            self.logger.error("Skipping event of Hue bridge %s, which is not configured", bridge_id)
+            return
+        if self.event_recorder:
+            self.event_recorder.record(bridge_id, event)
+
+        if event["type"] == "update":
+            heartbeat = self.heartbeats.get(bridge_id)
+            if heartbeat:
+                event["data"] = [item for item in event.get("data", []) if not heartbeat.is_echo(item)]
+                if not event["data"]:
+                    return
+
+            self._log_event(bridge_id, event)
+
+            self._schedule_updates(self._collect_update_batches(bridge_id, event))
+        else:
+            self._refresh_indexes_on_change(bridge_id, event)
+
+    def _log_event(self, bridge_id: str, event: dict):
+        """Logs an event as compact json, at most HUE_EVENT_LOG_PER_SEC per second.
+
+        Events are logged at info level on the console and at debug level when running as a service.
+        """
+        level = logging.DEBUG if self.running_as_service else logging.INFO
+        if not self.logger.isEnabledFor(level):
+            return
+        log, suppressed = self.event_log_sampler.sample()
+        if not log:
+            return
+        if suppressed:
+            self.logger.log(level, "%d Hue events not logged", suppressed)
+        self.logger.log(level, "Hue event of bridge %s: %s", bridge_id, LazyJson(event))
+
+    def _wait_for_updates(self):
+        """Blocks until all scheduled fixture updates have been processed."""
+        while True:
+            with self.update_lock:
+                if not self.pending_updates:
+                    return
+            time.sleep(0.01)
+
+    def _collect_update_batches(self, bridge_id: str, event: dict) -> List[Tuple[HueKey, ...]]:
+        """Maps a Hue event of a bridge onto batches of tracked lights.
+
+        Each changed light gets a batch of its own, except lights recalled by a scene or changed together
+        with their room or zone in the same event: these are combined into a single batch.
+        """
+        tracked = dict.fromkeys(f.hue_light_id for f in self.dmx_fixtures if f.hue_bridge_id == bridge_id)
+        self._refresh_indexes_on_change(bridge_id, event)
+        group_index = self.group_indexes[bridge_id]
+
+        grouped = set()
+        for button_id in self._button_short_releases(event):
+            lights = self.button_routes[bridge_id].lights_of(button_id)
+            if lights is None:
+                self.logger.info("Lights of button %s not known, refreshing all fixtures", button_id)
+                return [tuple((bridge_id, hue_id) for hue_id in tracked)]
+            grouped |= lights
+
+        changed = {item["id"] for item in event.get("data", []) if item.get("type") == "light" and "id" in item}
+        single = []
+        for item in event.get("data", []):
+            if item.get("type") == "button":
+                continue
+            lights = group_index.affected_lights(item)
+            if lights is not None:
+                grouped |= lights
+                continue
+            lights = group_index.grouped_lights(item)
+            if lights is not None:
+                grouped |= lights & changed  # only the lights reported as changed themselves
+            elif "id" in item:
+                single.append(item["id"])
+
+        batches = [((bridge_id, hue_id),) for hue_id in dict.fromkeys(single)
+                   if hue_id in tracked and hue_id not in grouped]
+        group_batch = tuple((bridge_id, hue_id) for hue_id in tracked if hue_id in grouped)
+        if group_batch:
+            batches.append(group_batch)
+        return batches
+
+    def _refresh_indexes_on_change(self, bridge_id: str, event: dict):
+        """Refreshes the cached group membership and button routes when the bridge configuration changes."""
+        if self.event_replay:
+            return  # replays keep the configuration recorded with the events
+        items = event.get("data", [])
+        group_index = self.group_indexes[bridge_id]
+        if any(group_index.is_membership_change(event["type"], item) for item in items):
+            group_index.refresh_async()
+        button_routes = self.button_routes[bridge_id]
+        if any(button_routes.is_routing_change(event["type"], item) for item in items):
+            button_routes.refresh_async()
 
     @staticmethod
-    def _contains_button_short_release(event: dict) -> bool:
-        """Checks if a Hue event contains a button short release."""
-        if "data" not in event:
-            return False
-
-        for item in event["data"]:
+    def _button_short_releases(event: dict) -> List[str]:
+        """Returns the ids of the buttons short released in a Hue event."""
+        result = []
+        for item in event.get("data", []):
             if item.get("type") == "button":
                 button = item.get("button", {})
                 if button.get("last_event") == "short_release":
-                    return True
-        return False
+                    result.append(item["id"])
+        return result
 
 
 if __name__ == "__main__":
     controller = DmxController()
     controller.send_heartbeat()  # Start sending heartbeat updates
+    controller.watch_fixtures()  # Start applying fixture configuration changes
     controller.track_and_update_fixtures()  # Start listening for updates
@@ -1,21 +1,48 @@
 """
 Copyright (c) 2023 Tom Kalmijn / MIT License.
 """
-from HueModel import HueLight
+from logging import Logger
+from typing import TYPE_CHECKING, Iterable, Tuple
+
+if TYPE_CHECKING:
+    from HueModel import HueLight
 
 
 class DmxFixture:
+    # slots keep hundreds of fixtures small, class attributes such as num_channels are shared
+    __slots__ = ("name", "hue_bridge_id", "hue_light_id", "dmx_address", "hueLamp")
+
     name: str
+    hue_bridge_id: str
     hue_light_id: str
     dmx_address: int
-    hueLamp: HueLight
+    num_channels: int = 0  # number of consecutive DMX channels starting at dmx_address
+    hueLamp: 'HueLight'
 
-    def __init__(self, name: str, hue_light_id: str, dmx_address: int):
+    def __init__(self, name: str, hue_light_id: str, dmx_address: int, hue_bridge_id: str = "1"):
         self.name = name
         self.dmx_address = dmx_address
         self.hue_light_id = hue_light_id
+        self.hue_bridge_id = hue_bridge_id
+
+    @property
+    def hue_key(self) -> Tuple[str, str]:
+        """Identifies the tracked Hue light across bridges."""
+        return self.hue_bridge_id, self.hue_light_id
+
+    def render(self, universe: memoryview):
+        """Writes the channels of the fixture into the universe, at index dmx_address onwards.
+
+        Values are computed before the first channel is written, so a fixture that cannot compute
+        its values leaves the channels as they were.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not implement render")
 
-    def get_dmx_message(self) -> bytes:
-        print("not implemented!")
-        return bytes()
 
+def render_fixtures(fixtures: Iterable[DmxFixture], universe: memoryview, logger: Logger):
+    """Renders fixtures into the universe, a fixture that fails is logged and skipped."""
+    for fixture in fixtures:
+        try:
+            fixture.render(universe)
+        except Exception as e:
+            logger.error("Error updating fixture %s: %s", fixture.name, e)
@@ -0,0 +1,140 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import argparse
+import collections
+import mmap
+import statistics
+import struct
+import threading
+import time
+from logging import Logger
+from typing import Dict, Iterator, List, Optional, Tuple
+
+Changes = List[Tuple[int, int]]  # (channel, value) pairs
+
+# Capture file layout: a magic header followed by one record per frame. A record is a header
+# with the monotonic timestamp in ns and the number of changed channels, followed by a
+# (channel, value) pair per changed channel. The unused rest of the file is zero filled, so
+# a record with timestamp 0 marks the end.
+FILE_MAGIC = b"DMXCAP1\0"
+RECORD_HEADER = struct.Struct("<QH")
+CHANGE = struct.Struct("<HB")
+
+
+class DmxFrameCapture:
+    """Keeps a diff-encoded history of emitted DMX frames for verification and timing analysis.
+
+    Only the channels that changed since the previous frame are stored. The most recent frames
+    are kept in a ring buffer and, optionally, all frames are written to a memory-mapped file
+    until it is full.
+    """
+    ring_size: int
+    path: Optional[str]
+
+    def __init__(self, ring_size: int, path: Optional[str] = None, file_size: int = 16 * 1024 * 1024,
+                 logger: Optional[Logger] = None):
+        self.ring_size = ring_size
+        self.path = path
+        self.logger = logger
+        self.frames = collections.deque(maxlen=ring_size)  # (timestamp_ns, changes)
+        self._previous = bytearray(513)
+        self._lock = threading.Lock()
+        self._mmap: Optional[mmap.mmap] = None
+        self._offset = 0
+        self._frames_written = 0
+        if path:
+            with open(path, "w+b") as file:
+                file.truncate(file_size)
+                self._mmap = mmap.mmap(file.fileno(), file_size)
+            self._mmap[:len(FILE_MAGIC)] = FILE_MAGIC
+            self._offset = len(FILE_MAGIC)
+
+    def record(self, frame: bytes):
+        timestamp_ns = time.monotonic_ns()
+        with self._lock:
+            changes = [(channel, value) for channel, (value, previous) in enumerate(zip(frame, self._previous))
+                       if value != previous]
+            self._previous[:len(frame)] = frame
+            self.frames.append((timestamp_ns, changes))
+            if self._mmap is not None:
+                self._write(timestamp_ns, changes)
+
+    def _write(self, timestamp_ns: int, changes: Changes):
+        size = RECORD_HEADER.size + CHANGE.size * len(changes)
+        if self._offset + size + RECORD_HEADER.size > len(self._mmap):
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None  # file is full, the ring buffer keeps recording
+            if self.logger:
+                self.logger.warning("DMX capture file %s is full after %d frames, later frames are not written",
+                                    self.path, self._frames_written)
+            return
+        RECORD_HEADER.pack_into(self._mmap, self._offset, timestamp_ns, len(changes))
+        offset = self._offset + RECORD_HEADER.size
+        for channel, value in changes:
+            CHANGE.pack_into(self._mmap, offset, channel, value)
+            offset += CHANGE.size
+        self._offset = offset
+        self._frames_written += 1
+
+    def channel_timeline(self, channel: int) -> List[Tuple[int, int]]:
+        """Returns (timestamp_ns, value) for each buffered frame that changed the channel."""
+        with self._lock:
+            return channel_timeline(self.frames, channel)
+
+    def frame_timing(self) -> Dict[str, float]:
+        """Returns frame period and jitter statistics of the buffered frames in ms."""
+        with self._lock:
+            return frame_timing(self.frames)
+
+
+def read_capture_file(path: str) -> Iterator[Tuple[int, Changes]]:
+    """Yields (timestamp_ns, changes) for each frame in a capture file."""
+    with open(path, "rb") as file:
+        data = file.read()
+    if not data.startswith(FILE_MAGIC):
+        raise ValueError(f"{path} is not a DMX capture file")
+    offset = len(FILE_MAGIC)
+    while offset + RECORD_HEADER.size <= len(data):
+        timestamp_ns, count = RECORD_HEADER.unpack_from(data, offset)
+        if not timestamp_ns:
+            break
+        offset += RECORD_HEADER.size
+        changes = [CHANGE.unpack_from(data, offset + i * CHANGE.size) for i in range(count)]
+        offset += count * CHANGE.size
+        yield timestamp_ns, changes
+
+
+def channel_timeline(frames, channel: int) -> List[Tuple[int, int]]:
+    return [(timestamp_ns, value) for timestamp_ns, changes in frames for ch, value in changes if ch == channel]
+
+
+def frame_timing(frames) -> Dict[str, float]:
+    timestamps = [timestamp_ns for timestamp_ns, _ in frames]
+    periods = [(b - a) / 1e6 for a, b in zip(timestamps, timestamps[1:])]
+    if not periods:
+        return {"frames": len(timestamps)}
+    return {
+        "frames": len(timestamps),
+        "period_mean_ms": statistics.fmean(periods),
+        "period_min_ms": min(periods),
+        "period_max_ms": max(periods),
+        "jitter_ms": statistics.pstdev(periods),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect a DMX capture file written with DMX_CAPTURE_FILE.")
+    parser.add_argument("path")
+    parser.add_argument("--channel", type=int, help="print the timeline of a single DMX channel (1-512)")
+    args = parser.parse_args()
+
+    captured = list(read_capture_file(args.path))
+    if args.channel:
+        start_ns = captured[0][0] if captured else 0
+        for t_ns, channel_value in channel_timeline(captured, args.channel):
+            print(f"{(t_ns - start_ns) / 1e6:12.3f} ms  {channel_value:3d}")
+    else:
+        for key, stat in frame_timing(captured).items():
+            print(f"{key}: {stat:.3f}" if isinstance(stat, float) else f"{key}: {stat}")
@@ -0,0 +1,316 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import struct
+import threading
+import time
+from logging import Logger
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from DmxBufferedSender import DmxFrameSource
+from DmxFixture import DmxFixture, render_fixtures
+
+SEQUENCE = struct.Struct("Q")
+UNIVERSE_SIZE = 513  # start byte plus 512 channels
+TIMING_TIMEOUT_SEC = 1
+
+
+def create_dmx_sender(test_mode: bool, logger: Logger):
+    """Creates the output backend configured by STUB_DMX, DMX_FRAME_RATE and DMX_CAPTURE_*."""
+    # the output backends are imported here, so the stub never loads libftdi and vice versa
+    frame_rate = float(os.getenv('DMX_FRAME_RATE', 0))
+    if test_mode:
+        from DmxFrameCapture import DmxFrameCapture
+        from DmxStubSender import DmxStubSender
+
+        logger.info("Initializing stub DMX sender")
+        capture = DmxFrameCapture(
+            ring_size=int(os.getenv('DMX_CAPTURE_FRAMES', 1000)),
+            path=os.getenv('DMX_CAPTURE_FILE'),
+            file_size=int(os.getenv('DMX_CAPTURE_FILE_SIZE', 16 * 1024 * 1024)),
+            logger=logger
+        )
+        return DmxStubSender(logger=logger, capture=capture, frame_rate=frame_rate)
+
+    from DmxSender import DmxSender
+
+    logger.info("Initializing DMX sender")
+    return DmxSender(logger=logger, frame_rate=frame_rate)
+
+
+class DmxSharedUniverse:
+    """A DMX universe in shared memory, guarded by a sequence counter (a seqlock).
+
+    The layout is an 8 byte sequence number followed by the 513 bytes of the universe. There is a
+    single writer, which makes the sequence odd while it writes and even again when done. A reader
+    copies the universe and retries when the sequence was odd or changed in the meantime, so it
+    never blocks the writer and never sees a half written update.
+    """
+    shared_memory: SharedMemory
+
+    def __init__(self, name: Optional[str] = None):
+        if name is None:
+            self.shared_memory = SharedMemory(create=True, size=SEQUENCE.size + UNIVERSE_SIZE)
+        else:
+            self.shared_memory = SharedMemory(name=name)
+        self._buffer = self.shared_memory.buf
+        self._universe = self._buffer[SEQUENCE.size:SEQUENCE.size + UNIVERSE_SIZE]
+
+    @property
+    def name(self) -> str:
+        return self.shared_memory.name
+
+    def _sequence(self) -> int:
+        return SEQUENCE.unpack_from(self._buffer)[0]
+
+    def write(self, messages: Iterable[Tuple[int, bytes]], fixtures: Iterable[DmxFixture] = (),
+              logger: Optional[Logger] = None):
+        """Writes channel data at DMX addresses and renders fixtures straight into shared memory.
+
+        The caller makes sure there is only one writer.
+        """
+        sequence = self._sequence()
+        SEQUENCE.pack_into(self._buffer, 0, sequence + 1)
+        try:
+            for address, data in messages:
+                self._universe[address:address + len(data)] = data
+            render_fixtures(fixtures, self._universe, logger)
+        finally:
+            SEQUENCE.pack_into(self._buffer, 0, sequence + 2)
+
+    def read(self, into: bytearray) -> int:
+        """Copies a consistent universe into a 513 byte buffer, returns its sequence number."""
+        while True:
+            before = self._sequence()
+            if before % 2:
+                time.sleep(0)  # a write is in progress, let the writer finish
+                continue
+            into[:] = self._universe
+            if self._sequence() == before:
+                return before
+
+    def close(self):
+        self._universe.release()
+        self._buffer.release()
+        self.shared_memory.close()
+
+
+class DmxProcessSender(DmxFrameSource):
+    """Output backend for DMX_OUTPUT_PROCESS=true: runs the actual sender in a separate process.
+
+    Event parsing, validation, logging and color conversion all compete for the GIL with the
+    thread writing frames. Here the controller only writes channel bytes into a DmxSharedUniverse
+    and signals the output process, which copies the universe into its own sender and schedules
+    the frame. Frame timing comes back over a pipe, log records over a queue. Frames sent only
+    come back while a frame listener is added. When the output process dies it is started again,
+    backing off, and picks up the universe from shared memory.
+    """
+    universe: DmxSharedUniverse
+    logger: Logger
+
+    def __init__(self, test_mode: bool, logger: Logger):
+        super().__init__(logger)
+        self.test_mode = test_mode
+        self.universe = DmxSharedUniverse()
+        self._write_lock = threading.Lock()
+        self._pipe_lock = threading.Lock()
+        self._timing_lock = threading.Lock()
+        self._timing_replies = queue.Queue()
+        self._connect_requested = False
+        self._stopping = False
+
+        # spawn instead of fork: the controller already runs threads, which fork does not copy
+        self._context = multiprocessing.get_context("spawn")
+        # released by each write, acquired by the output process before it reads the universe. Unlike
+        # an Event, releasing never waits for the other side, which may have died while waiting.
+        self._changed = self._context.BoundedSemaphore(1)
+        self._start_process()
+
+        threading.Thread(target=self._supervise, daemon=True).start()
+        atexit.register(self._remove_universe)
+
+    def _start_process(self):
+        pipe, child_pipe = self._context.Pipe()
+        log_queue = self._context.Queue()  # a new queue, a killed process may still hold the lock of the old one
+        process = self._context.Process(
+            target=run_output_process,
+            args=(self.universe.name, self._changed, child_pipe, log_queue, self.test_mode, self.logger.level),
+            name="dmx-output",
+            daemon=True
+        )
+        process.start()
+        child_pipe.close()
+        with self._pipe_lock:
+            self._pipe = pipe
+            self.process = process
+        threading.Thread(target=self._receive_logs, args=(process, log_queue), daemon=True).start()
+        self.logger.info(f"Started DMX output process {process.pid}")
+
+        # a restarted process starts from scratch
+        if self._connect_requested:
+            self._send(("connect",))
+        if self.frame_listeners:
+            self._send(("frames",))
+
+    @property
+    def dmx_data(self) -> bytes:
+        data = bytearray(UNIVERSE_SIZE)
+        self.universe.read(data)
+        return bytes(data)
+
+    def connect(self):
+        """Lets the output process look for the FTDI device."""
+        self._connect_requested = True
+        self._send(("connect",))
+
+    def add_frame_listener(self, listener: Callable[[bytes], None]):
+        """Adds a listener, from then on the output process sends back every frame."""
+        super().add_frame_listener(listener)
+        if len(self.frame_listeners) == 1:
+            self._send(("frames",))
+
+    def send_message(self, address: int, data: bytes):
+        self.send_messages([(address, data)])
+
+    def send_messages(self, messages: List[Tuple[int, bytes]]):
+        with self._write_lock:
+            self.universe.write(messages)
+        self.send_buffer()
+
+    def send_fixtures(self, fixtures: Iterable[DmxFixture], messages: Iterable[Tuple[int, bytes]] = ()):
+        with self._write_lock:
+            self.universe.write(messages, fixtures, self.logger)
+        self.send_buffer()
+
+    def send_buffer(self):
+        try:
+            self._changed.release()
+        except ValueError:
+            pass  # a change is already signalled
+
+    def frame_timing(self) -> Dict[str, float]:
+        with self._timing_lock:
+            if not self._send(("timing",)):
+                return {}
+            try:
+                return self._timing_replies.get(timeout=TIMING_TIMEOUT_SEC)
+            except queue.Empty:
+                self.logger.error("No frame timing received from the DMX output process")
+                return {}
+
+    def _send(self, message: Tuple[Any, ...]) -> bool:
+        """Sends a command to the output process, returns False when it is not running."""
+        with self._pipe_lock:
+            try:
+                self._pipe.send(message)
+                return True
+            except OSError:
+                return False  # the supervisor restarts the process
+
+    def _supervise(self):
+        """Handles messages of the output process and starts it again when it stops."""
+        delay_sec = 1
+        while True:
+            started = time.monotonic()
+            self._receive_messages()
+            self.process.join()
+            if self._stopping:
+                return
+            if time.monotonic() - started > 60:
+                delay_sec = 1
+            self.logger.error(f"DMX output process stopped with exit code {self.process.exitcode}, "
+                              f"restarting in {delay_sec} s")
+            time.sleep(delay_sec)
+            delay_sec = min(delay_sec * 2, 30)
+            self._start_process()
+
+    def _receive_messages(self):
+        """Handles messages of the output process until it stops."""
+        while True:
+            try:
+                kind, value = self._pipe.recv()
+            except (EOFError, OSError):
+                return
+            if kind == "frame":
+                self._notify_frame_listeners(value)
+            elif kind == "timing":
+                self._timing_replies.put(value)
+
+    def _remove_universe(self):
+        self._stopping = True  # the output process is terminated on exit, this is no failure
+        self.universe.close()
+        self.universe.shared_memory.unlink()
+
+    def _receive_logs(self, process, log_queue):
+        while True:
+            try:
+                record = log_queue.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    return
+                continue
+            self.logger.handle(record)
+
+
+def run_output_process(universe_name: str, changed, pipe, log_queue, test_mode: bool, log_level: int):
+    """Entry point of the output process: mirrors the shared universe into a local sender."""
+    logger = logging.getLogger("DmxController.output")
+    logger.setLevel(log_level)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.propagate = False
+
+    universe = DmxSharedUniverse(universe_name)
+    sender = create_dmx_sender(test_mode, logger)
+    pipe_lock = threading.Lock()
+
+    def send(message: Tuple[str, Any]):
+        with pipe_lock:
+            pipe.send(message)
+
+    def mirror_universe():
+        data = bytearray(UNIVERSE_SIZE)
+        while True:
+            # the first read needs no signal: a restarted process picks up the universe as it is,
+            # even when the process it replaces was killed after taking the last signal
+            universe.read(data)
+            sender.send_messages([(0, data)])  # the start byte is always 0
+            changed.acquire()  # taken before reading, so a write during the read is not missed
+
+    # frames are handed to a separate thread, so a slow controller never holds up the output thread
+    latest_frame = queue.Queue(maxsize=1)
+
+    def offer_frame(frame: bytes):
+        try:
+            latest_frame.get_nowait()
+        except queue.Empty:
+            pass
+        latest_frame.put_nowait(frame)
+
+    def forward_frames():
+        while True:
+            send(("frame", latest_frame.get()))
+
+    threading.Thread(target=mirror_universe, daemon=True).start()
+    threading.Thread(target=forward_frames, daemon=True).start()
+
+    while True:
+        try:
+            command = pipe.recv()
+        except EOFError:
+            return  # the controller is gone
+        if command[0] == "connect":
+            threading.Thread(target=sender.connect, daemon=True).start()
+        elif command[0] == "frames":
+            # frames are only sent back once the controller has a frame listener
+            if offer_frame not in sender.frame_listeners:
+                sender.frame_listeners.append(offer_frame)
+                offer_frame(bytes(sender.dmx_data))  # the listener starts with the current frame
+        elif command[0] == "timing":
+            send(("timing", sender.frame_timing()))
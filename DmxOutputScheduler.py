@@ -0,0 +1,90 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import collections
+import threading
+import time
+from logging import Logger
+from typing import Callable, Dict
+
+from DmxFrameCapture import frame_timing
+
+# Sleeping is only accurate to a millisecond or worse on a loaded host, so the last stretch
+# before a deadline is spent spinning on the clock instead.
+SPIN_SEC = 0.002
+
+# A full frame takes about 23 ms on the wire (break + 513 slots of 44 us). The FTDI chip buffers
+# writes, so starting the next break sooner would cut off the previous frame.
+MIN_FRAME_PERIOD_SEC = 0.025
+
+
+def wait_until(deadline: float):
+    """Waits until a time.perf_counter() deadline."""
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        if remaining > SPIN_SEC:
+            time.sleep(remaining - SPIN_SEC)
+
+
+class DmxOutputScheduler:
+    """Sends DMX frames from a dedicated thread on a monotonic-clock deadline loop.
+
+    A frame is sent as soon as possible after request_frame(), but never sooner than
+    MIN_FRAME_PERIOD_SEC after the previous one; requests in between are combined into a single
+    frame. With a frame rate above 0 the universe is also repeated at that rate, for fixtures
+    without a 'Hold' function. The start time of each frame sent is kept to report the actual
+    frame period and jitter.
+    """
+    send_frame: Callable[[], bool]
+    refresh_period: float | None
+    logger: Logger
+
+    def __init__(self, send_frame: Callable[[], bool], frame_rate: float, logger: Logger):
+        self.send_frame = send_frame
+        self.refresh_period = max(1 / frame_rate, MIN_FRAME_PERIOD_SEC) if frame_rate > 0 else None
+        self.logger = logger
+        self.frame_times = collections.deque(maxlen=250)  # (timestamp_ns, None), see DmxFrameCapture
+        self._condition = threading.Condition()
+        self._requested = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def request_frame(self):
+        with self._condition:
+            self._requested = True
+            self._condition.notify()
+
+    def frame_timing(self) -> Dict[str, float]:
+        """Returns frame period and jitter statistics of the most recent frames in ms."""
+        return frame_timing(list(self.frame_times))
+
+    def _run(self):
+        last_frame = float("-inf")
+        next_refresh = time.perf_counter()
+        while True:
+            with self._condition:
+                while not self._requested:
+                    if self.refresh_period is None:
+                        self._condition.wait()
+                    else:
+                        timeout = next_refresh - time.perf_counter()
+                        if timeout <= 0:
+                            break
+                        self._condition.wait(timeout)
+                requested = self._requested
+                self._requested = False
+
+            wait_until(last_frame + MIN_FRAME_PERIOD_SEC)
+            last_frame = time.perf_counter()
+            started_ns = time.monotonic_ns()
+            try:
+                if self.send_frame():
+                    self.frame_times.append((started_ns, None))
+            except Exception as e:
+                self.logger.error("Error sending DMX frame: %s", e)
+
+            if self.refresh_period is not None:
+                # refresh frames stay on a fixed grid, a requested frame restarts it
+                next_refresh = last_frame + self.refresh_period if requested else next_refresh + self.refresh_period
+                next_refresh = max(next_refresh, last_frame + MIN_FRAME_PERIOD_SEC)
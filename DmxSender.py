@@ -1,33 +1,97 @@
 """
 Copyright (c) 2023 Tom Kalmijn / MIT License.
 """
-import sys
+import collections
+import ctypes
+import statistics
+import threading
 import time
 from logging import Logger
+from typing import TYPE_CHECKING, Dict, Optional
 
-from pylibftdi import Device, Driver
+from DmxBufferedSender import DmxBufferedSender
+from DmxOutputScheduler import wait_until
 
+if TYPE_CHECKING:
+    from pylibftdi import Device
 
-class DmxSender:
+
+# libftdi line properties
+BITS_8, STOP_BIT_2, PARITY_NONE = 8, 2, 0
+BREAK_OFF, BREAK_ON = 0, 1
+
+BREAK_SEC = 0.000176  # DMX512 requires at least 92 us, 176 us is what most controllers send
+MARK_AFTER_BREAK_SEC = 0.000012  # at least 12 us
+
+
+class DmxSender(DmxBufferedSender):
     ftdi_serial: str = None
-    dmx_data = bytearray(513)
 
-    # 513: one start byte (0x00) plus 512 bytes of channel data
-    # dmx_data is automatically filled with zeros, incidentally also correctly setting the start byte.
-    # According to DMX512, when sending a message to a fixture, we need to repeat the untouched DMX
-    # channels. For this reason channel data is buffered in dmx_data.
+    # While no FTDI device is connected, messages only update dmx_data. When the device is
+    # (re)connected, the full buffered universe is sent. Frames are written to the device from
+    # dmx_data itself through a ctypes array sharing its memory, so nothing is copied.
+
+    def __init__(self, logger: Logger, frame_rate: float = 0):
+        self.ftdi_port: Optional['Device'] = None  # kept open while the device is healthy
+        self.reconnecting = threading.Event()
+        self.break_times = collections.deque(maxlen=250)  # measured break lengths in seconds
+        super().__init__(logger, frame_rate)
+        self.frame_buffer = (ctypes.c_ubyte * len(self.dmx_data)).from_buffer(self.dmx_data)
+
+    def connect(self):
+        """Looks for the FTDI device, backing off until it is found, and sends the buffered universe."""
+        delay_sec = 1
+        while not (self.init_ftdi_driver() and self._open_port()):
+            time.sleep(delay_sec)
+            delay_sec = min(delay_sec * 2, 30)
+        self.send_buffer()
+
+    def _reconnect_in_background(self):
+        """Starts a background connect() after the device was lost, unless one is already running."""
+        if self.reconnecting.is_set():
+            return
+        self.reconnecting.set()
+
+        def reconnect():
+            try:
+                self.connect()
+            finally:
+                self.reconnecting.clear()
 
-    def __init__(self, logger: Logger):
-        self.logger = logger
-        self.init_ftdi_driver()
+        threading.Thread(target=reconnect, daemon=True).start()
 
-    def init_ftdi_driver(self):
+    def _open_port(self) -> bool:
+        ftdi_port = None
         try:
+            from pylibftdi import Device
+
+            ftdi_port = Device(self.ftdi_serial)
+            ftdi_port.baudrate = 250000
+            ftdi_port.ftdi_fn.ftdi_set_line_property(BITS_8, STOP_BIT_2, PARITY_NONE)
+            ftdi_port.flush()
+            with self.lock:
+                self.ftdi_port = ftdi_port
+            return True
+        except Exception as e:
+            self.logger.error("Cannot open FTDI port %s: %s", self.ftdi_serial, e)
+            if ftdi_port is not None:
+                try:
+                    ftdi_port.close()  # release the libftdi context and USB handle before retrying
+                except Exception:
+                    pass
+            return False
+
+    def init_ftdi_driver(self) -> bool:
+        """Looks for an FTDI device, returns whether one with a valid serial was found."""
+        self.ftdi_serial = None
+        try:
+            from pylibftdi import Driver  # deferred: loading libftdi is slow and not needed before probing
+
             driver = Driver()
             devices = driver.list_devices()
             if not devices:
                 self.logger.error("No FTDI devices found")
-                sys.exit(1)
+                return False
             for device in devices:
                 manufacturer, description, serial = device
                 if manufacturer == "FTDI":
@@ -37,35 +101,60 @@ class DmxSender:
                         break
                     else:
                         self.logger.error("Serial number not available, eeprom may need to be reprogrammed (see 'eeprom' folder)")
-                        sys.exit(1)
+                        return False
 
             if not self.ftdi_serial:
                 self.logger.error("No FTDI devices with a valid serial found")
-                sys.exit(1)
+            return bool(self.ftdi_serial)
 
         except Exception as e:
             self.logger.error("Error initializing FTDI driver: %s", e)
-            raise e
+            return False
+
+    def _send_frame(self) -> bool:
+        """Sends the buffered universe, returns whether it was sent.
 
-    def send_message(self, address: int, data: bytes):
-        assert self.ftdi_serial, "FTDI driver is not initialized"
+        When sending fails the port is closed and the device is looked for again in the background.
+        """
+        if self.ftdi_port is None:
+            return False
         try:
-            self.dmx_data[address:address + len(data)] = data
-            # address equals offset because DMX addresses start with 1 skipping the start byte in the data packet.
-            with Device(self.ftdi_serial) as ftdi_port:
-                self.send_dmx_packet(ftdi_port, self.dmx_data)
+            self.break_times.append(self.send_dmx_packet(self.ftdi_port, self.frame_buffer))
+            return True
         except Exception as e:
-            self.logger.error("Cannot send dmx packet: %s", e)
+            self.logger.error("Cannot send dmx packet, reconnecting: %s", e)
+            try:
+                self.ftdi_port.close()
+            except Exception:
+                pass  # the device is most likely gone already
+            self.ftdi_port = None
+            self._reconnect_in_background()
+            return False
+
+    def frame_timing(self) -> Dict[str, float]:
+        """Returns the period and jitter of recent frames and the length of their breaks."""
+        result = super().frame_timing()
+        break_times = list(self.break_times)
+        if break_times:
+            result["break_mean_us"] = statistics.fmean(break_times) * 1e6
+            result["break_max_us"] = max(break_times) * 1e6
+        return result
 
     @staticmethod
-    def send_dmx_packet(ftdi_port: Device, data: bytes):
-        # reset dmx channel
-        ftdi_port.ftdi_fn.ftdi_set_bitmode(1, 0x01)  # break
-        ftdi_port.write(b'\x00')
-        time.sleep(0.001)
-        ftdi_port.write(b'\x01')
-        ftdi_port.ftdi_fn.ftdi_set_bitmode(0, 0x00)  # release break
-        ftdi_port.flush()
-        ftdi_port.ftdi_fn.ftdi_set_line_property(8, 2, 0)
-        ftdi_port.baudrate = 250000
-        ftdi_port.write(bytes(data))
+    def send_dmx_packet(ftdi_port: 'Device', frame: ctypes.Array) -> float:
+        """Sends a break, a mark after break and the frame, returns the measured break length in seconds.
+
+        The break is generated by the FTDI chip itself, timed against a monotonic clock deadline. The
+        frame is handed to libftdi as it is, Device.write() would copy it into a string buffer first.
+        """
+        set_line_property = ftdi_port.ftdi_fn.ftdi_set_line_property2
+        started = time.perf_counter()
+        set_line_property(BITS_8, STOP_BIT_2, PARITY_NONE, BREAK_ON)
+        wait_until(started + BREAK_SEC)
+        set_line_property(BITS_8, STOP_BIT_2, PARITY_NONE, BREAK_OFF)
+        released = time.perf_counter()
+        wait_until(released + MARK_AFTER_BREAK_SEC)
+        written = ftdi_port.ftdi_fn.ftdi_write_data(frame, len(frame))
+        if written < 0:
+            raise IOError(f"ftdi_write_data failed with error {written}")
+        return released - started
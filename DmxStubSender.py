@@ -0,0 +1,21 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+from logging import Logger
+
+from DmxBufferedSender import DmxBufferedSender
+from DmxFrameCapture import DmxFrameCapture
+
+
+class DmxStubSender(DmxBufferedSender):
+    """Output backend for STUB_DMX=true: buffers and schedules frames like DmxSender but captures them
+    instead of writing them to an FTDI device."""
+    capture: DmxFrameCapture
+
+    def __init__(self, logger: Logger, capture: DmxFrameCapture, frame_rate: float = 0):
+        self.capture = capture
+        super().__init__(logger, frame_rate)
+
+    def _send_frame(self) -> bool:
+        self.capture.record(self.dmx_data)
+        return True
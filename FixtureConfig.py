@@ -0,0 +1,115 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import os
+import re
+import threading
+import time
+from logging import Logger
+from typing import Callable, Dict, Mapping, NamedTuple, Type
+
+from dotenv import dotenv_values
+
+from DmxFixture import DmxFixture
+
+
+class FixtureSpec(NamedTuple):
+    name: str
+    hue_id: str
+    dmx_address: int
+    class_name: str
+    bridge_id: str
+
+
+def load_fixture_specs(values: Mapping[str, str], default_bridge_id: str, logger: Logger) -> Dict[str, FixtureSpec]:
+    """Reads all FIXTURE<n>_* settings, ordered by n and keyed by fixture name.
+
+    FIXTURE<n>_HUE_BRIDGE selects the bridge of the Hue light, it defaults to the first bridge.
+    Gaps in the numbering are allowed. An incomplete or invalid fixture, or one whose channels do
+    not fit in the universe, is logged and skipped without affecting the others.
+    """
+    numbers = sorted(int(match.group(1)) for match in (re.fullmatch(r"FIXTURE(\d+)_NAME", key) for key in values)
+                     if match)
+    result = {}
+    for i in numbers:
+        name = values.get(f"FIXTURE{i}_NAME")
+        hue_id = values.get(f"FIXTURE{i}_HUE_ID")
+        class_name = values.get(f"FIXTURE{i}_CLASS")
+        bridge_id = values.get(f"FIXTURE{i}_HUE_BRIDGE") or default_bridge_id
+        try:
+            dmx_address = int(values.get(f"FIXTURE{i}_DMX_ADDRESS", "0"))
+        except ValueError:
+            dmx_address = 0
+        if not (name and hue_id and class_name and 1 <= dmx_address <= 512):
+            logger.error(f"Skipping fixture {i}: NAME, HUE_ID, CLASS and a DMX_ADDRESS of 1-512 are required")
+            continue
+        if name in result:
+            logger.error(f"Skipping fixture {i}: name '{name}' is already in use")
+            continue
+        try:
+            num_channels = fixture_class(class_name).num_channels
+        except (ImportError, AttributeError) as e:
+            logger.error(f"Skipping fixture {i}: unknown CLASS '{class_name}': {e}")
+            continue
+        if dmx_address + num_channels - 1 > 512:
+            logger.error(f"Skipping fixture {i}: its {num_channels} channels from DMX_ADDRESS {dmx_address} "
+                         f"do not fit in the 512 channels of the universe")
+            continue
+        result[name] = FixtureSpec(name, hue_id, dmx_address, class_name, bridge_id)
+    return result
+
+
+def fixture_class(class_name: str) -> Type[DmxFixture]:
+    """Returns the fixture class of a FIXTURE<n>_CLASS, defined in the module of the same name."""
+    module = __import__(class_name)
+    return getattr(module, class_name)
+
+
+def create_fixture(spec: FixtureSpec) -> DmxFixture:
+    dmx_fixture_sub_class = fixture_class(spec.class_name)
+    return dmx_fixture_sub_class(spec.name, spec.hue_id, spec.dmx_address, spec.bridge_id)
+
+
+def fixture_spec(fixture: DmxFixture) -> FixtureSpec:
+    return FixtureSpec(fixture.name, fixture.hue_light_id, fixture.dmx_address, type(fixture).__name__,
+                       fixture.hue_bridge_id)
+
+
+class FixtureConfigWatcher:
+    """Polls a fixture configuration file and reports its fixtures whenever the file changes."""
+    path: str
+    interval_sec: float
+    default_bridge_id: str
+    logger: Logger
+
+    def __init__(self, path: str, interval_sec: float, default_bridge_id: str, logger: Logger):
+        self.path = path
+        self.interval_sec = interval_sec
+        self.default_bridge_id = default_bridge_id
+        self.logger = logger
+        self._mtime = self._read_mtime()
+
+    def load(self) -> Dict[str, FixtureSpec]:
+        return load_fixture_specs(dotenv_values(self.path), self.default_bridge_id, self.logger)
+
+    def start(self, on_change: Callable[[Dict[str, FixtureSpec]], None]):
+        def watch():
+            while True:
+                time.sleep(self.interval_sec)
+                mtime = self._read_mtime()
+                if mtime is None or mtime == self._mtime:
+                    continue  # a missing file is most likely being replaced, keep the running fixtures
+                self._mtime = mtime
+                self.logger.info(f"Fixture configuration {self.path} changed, reloading")
+                try:
+                    on_change(self.load())
+                except Exception as e:
+                    self.logger.error(f"Error reloading fixture configuration: {e}")
+
+        threading.Thread(target=watch, daemon=True).start()
+
+    def _read_mtime(self) -> float | None:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
@@ -2,85 +2,98 @@
 Copyright (c) 2023 Tom Kalmijn / MIT License.
 """
 import json
+import time
 from logging import Logger
-from typing import Dict, Any
+from typing import TYPE_CHECKING, Dict, Any, List
 
 import requests
 from urllib3.exceptions import InsecureRequestWarning
 
-from HueModel import HueLight
+from HueRequestScheduler import PRIORITY_REFRESH, PRIORITY_RESYNC, HueRequestScheduler
+
+if TYPE_CHECKING:
+    from HueModel import HueLight
 
 # suppress InsecureRequestWarning from urllib3
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 
 class HueBridge:
+    bridge_id: str
     api_key: str
     bridge_ip: str
     timeout_sec: int
     logger: Logger
     api_url_light: str
-    api_url_device: str
+    api_url_resource: str
     api_url_events: str
+    session: requests.Session
+    scheduler: HueRequestScheduler
+    last_stream_activity: float
 
-    def __init__(self, bridge_ip: str, api_key: str, timeout_sec: int, logger: Logger):
+    def __init__(self, bridge_ip: str, api_key: str, timeout_sec: int, logger: Logger, bridge_id: str = "1",
+                 requests_per_sec: float = 10, max_concurrent_requests: int = 5):
         self.logger = logger
+        self.bridge_id = bridge_id
         self.api_key = api_key
         self.bridge_ip = bridge_ip
         self.timeout_sec = timeout_sec
         self.api_url_light = f"https://{bridge_ip}/clip/v2/resource/light"
-        self.api_url_device = f"https://{bridge_ip}/clip/v2/resource/device"
+        self.api_url_resource = f"https://{bridge_ip}/clip/v2/resource"
         self.api_url_events = f"https://{bridge_ip}/eventstream/clip/v2"
+        # one pooled session, so requests reuse the TLS connection instead of setting up a new one
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.headers.update({"hue-application-key": self.api_key})
+        # all requests but the event stream are rate limited, the bridge handles about 10 per second
+        self.scheduler = HueRequestScheduler(self.session, requests_per_sec, max_concurrent_requests, logger)
+        self.last_stream_activity = time.monotonic()  # the event stream times out after timeout_sec of silence
 
-
-    def list_light_ids_and_names(self) -> Dict[str, str]:
-        headers = {
-            "hue-application-key": self.api_key,
-            "Accept": "application/json"
-        }
-        response = requests.get(self.api_url_light, headers=headers, verify=False)
-        response.raise_for_status()
-        json = response.json()
-        result = {}  # map of device id to user provided name
-        for device in json['data']:
-            result[device['id']] = device['metadata']['name']
-        return result
+    def _request(self, method: str, url: str, priority: int = PRIORITY_REFRESH, **kwargs) -> requests.Response:
+        return self.scheduler.request(method, url, priority, **kwargs)
 
     def get_light_url(self, hue_light_id: str) -> str:
         return f"{self.api_url_light}/{hue_light_id}"
 
-    def get_light(self, hue_light_id: str) -> HueLight:
-        headers = {
-            "hue-application-key": self.api_key,
-            "Accept": "application/json"
-        }
-        response = requests.get(url=self.get_light_url(hue_light_id), headers=headers, verify=False)
-        response.raise_for_status()
+    def get_light(self, hue_light_id: str, priority: int = PRIORITY_REFRESH) -> 'HueLight':
+        from HueModel import HueLight  # deferred: importing pydantic models is slow and not needed to listen
+
+        response = self._request("GET", self.get_light_url(hue_light_id), priority)
         response_data = response.json()
         response_json = json.dumps(response_data["data"][0])
         return HueLight.model_validate_json(response_json)
 
-    def set_light_state(self, hue_light_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
-        headers = {
-            "hue-application-key": self.api_key,
-            "Accept": "application/json"
-        }
-        response = requests.put(url=self.get_light_url(hue_light_id), json=state, headers=headers, verify=False)
-        response.raise_for_status()
+    def get_lights(self, priority: int = PRIORITY_REFRESH) -> Dict[str, 'HueLight']:
+        """Fetches all lights in a single request, mapped by light id."""
+        from HueModel import HueLight
+
+        result = {}
+        for light in self.get_resources("light", priority):
+            hue_light = HueLight.model_validate(light)
+            result[hue_light.id] = hue_light
+        return result
+
+    def get_resources(self, resource_type: str, priority: int = PRIORITY_RESYNC) -> List[Dict[str, Any]]:
+        """Fetches the raw json of all resources of a type, e.g. 'room', 'zone' or 'scene'."""
+        response = self._request("GET", f"{self.api_url_resource}/{resource_type}", priority)
+        return response.json()["data"]
+
+    def set_light_state(self, hue_light_id: str, state: Dict[str, Any],
+                        priority: int = PRIORITY_REFRESH) -> Dict[str, Any]:
+        response = self._request("PUT", self.get_light_url(hue_light_id), priority, json=state)
         return response.json()
 
     def event_stream(self):
         headers = {
-            "hue-application-key": self.api_key,
             "Connection": "keep-alive",
             "Accept": "text/event-stream"
         }
-        with requests.get(self.api_url_events, headers=headers, stream=True, verify=False,
-                          timeout=self.timeout_sec) as response:
+        with self.session.get(self.api_url_events, headers=headers, stream=True, timeout=self.timeout_sec) as response:
             response.raise_for_status()
             try:
                 buffer = ""
                 for line in response.iter_lines(decode_unicode=True):
+                    self.last_stream_activity = time.monotonic()
                     if line:
                         buffer += line + "\n"
                     else:
@@ -92,7 +105,7 @@ class HueBridge:
                         buffer = ""
             except Exception as e:
                 # non-fatal: caller may simply call event_stream(...) again
-                self.logger.error("Lost connection to Hue bridge: %s", e)
+                self.logger.error("Lost connection to Hue bridge %s: %s", self.bridge_id, e)
 
     def parse_sse_event(self, sse_event: str) -> Dict[str, Any] | None:
         try:
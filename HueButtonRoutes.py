@@ -0,0 +1,101 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+from logging import Logger
+from typing import Any, Dict, FrozenSet, Set, Tuple
+
+from BackgroundRefresh import BackgroundRefresh
+from HueBridge import HueBridge
+from HueGroupIndex import HueGroupIndex
+
+ResourceRef = Tuple[str, str]  # (rid, rtype)
+
+
+class HueButtonRoutes(BackgroundRefresh):
+    """Routes button presses to the lights they control.
+
+    Switches are configured on the bridge through behavior instances. Their configuration names
+    the switch device, optionally each of its buttons, and the rooms, zones or lights they act on.
+    Targets are kept as resource references and resolved to lights through the group index at
+    press time, so changes to a room do not require rebuilding the routes.
+    """
+    TARGET_TYPES = ("light", "grouped_light", "room", "zone", "bridge_home", "scene")
+    ROUTING_TYPES = ("behavior_instance", "device", "button")
+    refresh_name = "Hue button routes"
+
+    hue_bridge: HueBridge
+    group_index: HueGroupIndex
+    logger: Logger
+
+    def __init__(self, hue_bridge: HueBridge, group_index: HueGroupIndex, logger: Logger):
+        self.hue_bridge = hue_bridge
+        self.group_index = group_index
+        self.logger = logger
+        self._routes: Dict[str, FrozenSet[ResourceRef]] = {}  # button id -> targets
+        self._init_refresh()
+
+    def _rebuild(self):
+        """Rebuilds the routes from the bridge's device and behavior configuration."""
+        device_buttons: Dict[str, Set[str]] = {}
+        for device in self.hue_bridge.get_resources("device"):
+            device_buttons[device["id"]] = {service["rid"] for service in device.get("services", [])
+                                            if service["rtype"] == "button"}
+
+        routes: Dict[str, Set[ResourceRef]] = {}
+        for behavior in self.hue_bridge.get_resources("behavior_instance"):
+            configuration = behavior.get("configuration", {})
+            shared_targets = self._find_targets({key: value for key, value in configuration.items()
+                                                 if key not in ("device", "buttons")})
+            buttons = configuration.get("buttons", {})
+            button_ids = set(buttons) if isinstance(buttons, dict) else set()
+            device = configuration.get("device", {})
+            if device.get("rtype") == "device":
+                button_ids |= device_buttons.get(device["rid"], set())
+
+            for button_id in button_ids:
+                targets = shared_targets | self._find_targets(buttons.get(button_id, {}))
+                routes.setdefault(button_id, set()).update(targets)
+
+        self._routes = {button_id: frozenset(targets) for button_id, targets in routes.items() if targets}
+        self.logger.info(f"Routed {len(self._routes)} Hue buttons")
+
+    def lights_of(self, button_id: str) -> FrozenSet[str] | None:
+        """Returns the lights controlled by a button, or None when they are not known.
+
+        That is the case for a button without a route, and for a room, zone or scene target the group
+        index cannot resolve (yet), e.g. while it is still being built at startup.
+        """
+        targets = self._routes.get(button_id)
+        if targets is None:
+            return None
+        lights: Set[str] = set()
+        for rid, rtype in targets:
+            if rtype == "light":
+                lights.add(rid)
+                continue
+            group_lights = self.group_index.lights_of(rid)
+            if not group_lights:
+                return None
+            lights |= group_lights
+        return frozenset(lights)
+
+    def is_routing_change(self, event_type: str, item: Dict[str, Any]) -> bool:
+        """Checks if an event item changes switch configuration, in which case the routes are stale."""
+        item_type = item.get("type")
+        if item_type == "behavior_instance":
+            return True
+        return item_type in self.ROUTING_TYPES and event_type in ("add", "delete")
+
+    @classmethod
+    def _find_targets(cls, configuration: Any) -> Set[ResourceRef]:
+        """Collects all references to lights, groups and scenes in a (nested) configuration."""
+        targets = set()
+        if isinstance(configuration, dict):
+            if configuration.get("rtype") in cls.TARGET_TYPES and "rid" in configuration:
+                targets.add((configuration["rid"], configuration["rtype"]))
+            for value in configuration.values():
+                targets |= cls._find_targets(value)
+        elif isinstance(configuration, list):
+            for value in configuration:
+                targets |= cls._find_targets(value)
+        return targets
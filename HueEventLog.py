@@ -0,0 +1,193 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import copy
+import json
+import threading
+import time
+from logging import Logger
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Tuple
+
+from HueRequestScheduler import PRIORITY_REFRESH, PRIORITY_RESYNC
+
+if TYPE_CHECKING:
+    from HueModel import HueLight
+
+# resources recorded when recording starts, everything a replay needs instead of the bridge
+RECORDED_RESOURCE_TYPES = ("light", "device", "room", "zone", "bridge_home", "scene", "behavior_instance")
+
+
+class HueEventRecorder:
+    """Appends Hue bridge events to a file, one json line per event:
+    {"t": <unix time>, "bridge": <bridge id>, "event": {...}}.
+
+    The resources of each bridge are recorded first, as {"t": ..., "bridge": ..., "resources": {...}},
+    so the file can be replayed without the bridge.
+    """
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def record(self, bridge_id: str, event: Dict[str, Any]):
+        self._write({"t": round(time.time(), 4), "bridge": bridge_id, "event": event})
+
+    def record_resources(self, bridge_id: str, resources: Dict[str, List[Dict[str, Any]]]):
+        self._write({"t": round(time.time(), 4), "bridge": bridge_id, "resources": resources})
+
+    def _write(self, record: Dict[str, Any]):
+        line = json.dumps(record, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+
+class HueReplayBridge:
+    """Stands in for a HueBridge while replaying, so a replay needs no bridge and no network.
+
+    It serves the resources recorded with the events. Each replayed event is merged into them
+    before it is processed, so a light is fetched with the state it had at that moment.
+    """
+    bridge_id: str
+    logger: Logger
+    last_stream_activity: float
+
+    def __init__(self, bridge_id: str, logger: Logger):
+        self.bridge_id = bridge_id
+        self.logger = logger
+        self.last_stream_activity = time.monotonic()
+        self._lock = threading.Lock()
+        self._resources: Dict[str, Dict[str, Dict[str, Any]]] = {}  # type -> id -> raw json
+
+    def load_resources(self, resources: Dict[str, List[Dict[str, Any]]]):
+        with self._lock:
+            self._resources = {resource_type: {item["id"]: item for item in items}
+                               for resource_type, items in resources.items()}
+
+    def apply_event(self, event: Dict[str, Any]):
+        """Merges the items of a replayed event into the recorded resources."""
+        with self._lock:
+            for item in event.get("data", []):
+                if "id" not in item or "type" not in item:
+                    continue
+                items = self._resources.setdefault(item["type"], {})
+                if event.get("type") == "delete":
+                    items.pop(item["id"], None)
+                elif event.get("type") == "add" or item["id"] not in items:
+                    items[item["id"]] = item
+                else:
+                    items[item["id"]] = _merge(items[item["id"]], item)
+
+    def get_light(self, hue_light_id: str, priority: int = PRIORITY_REFRESH) -> 'HueLight':
+        from HueModel import HueLight
+
+        with self._lock:
+            light = self._resources.get("light", {}).get(hue_light_id)
+        if light is None:
+            raise LookupError(f"Hue light {hue_light_id} is not in the recording")
+        return HueLight.model_validate(light)
+
+    def get_lights(self, priority: int = PRIORITY_REFRESH) -> Dict[str, 'HueLight']:
+        from HueModel import HueLight
+
+        return {light["id"]: HueLight.model_validate(light) for light in self.get_resources("light", priority)}
+
+    def get_resources(self, resource_type: str, priority: int = PRIORITY_RESYNC) -> List[Dict[str, Any]]:
+        with self._lock:
+            return copy.deepcopy(list(self._resources.get(resource_type, {}).values()))
+
+
+def _merge(resource: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns a copy of a resource with the fields of an update event item merged in."""
+    result = dict(resource)
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = _merge(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+class HueEventReplay:
+    """Replays a file written by HueEventRecorder as if it were the event stream of a Hue bridge.
+
+    A speed of 1 keeps the recorded timing, a speed of N plays N times faster and a speed of 0
+    plays the events back to back, as fast as they can be consumed. Events recorded without a
+    bridge id are attributed to the default bridge.
+
+    Light state and configuration come from the replay bridges, which `load` fills with the first
+    resources recorded for each bridge. Resources recorded later replace them when they are reached.
+    """
+    path: str
+    speed: float
+    default_bridge_id: str
+    bridges: Dict[str, HueReplayBridge]
+    logger: Logger
+
+    def __init__(self, path: str, speed: float, default_bridge_id: str, bridges: Dict[str, HueReplayBridge],
+                 logger: Logger):
+        self.path = path
+        self.speed = speed
+        self.default_bridge_id = default_bridge_id
+        self.bridges = bridges
+        self.logger = logger
+
+    def load(self):
+        """Loads the first recorded resources of each bridge, so fixtures and indexes can be set up."""
+        loaded = set()
+        for bridge_id, resources in self._records("resources"):
+            if bridge_id in self.bridges and bridge_id not in loaded:
+                self.bridges[bridge_id].load_resources(resources)
+                loaded.add(bridge_id)
+        for bridge_id in self.bridges.keys() - loaded:
+            self.logger.error(f"No resources of Hue bridge {bridge_id} recorded in {self.path}")
+
+    def _records(self, kind: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # logged when the events are replayed
+                if isinstance(record, dict) and kind in record:
+                    yield record.get("bridge", self.default_bridge_id), record[kind]
+
+    def event_stream(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yields (bridge id, event) pairs."""
+        count = 0
+        started = time.monotonic()
+        first_t = None
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    self.logger.error(f"Cannot parse recorded event: {e}")
+                    continue
+                if isinstance(record, dict) and "resources" in record:
+                    bridge = self.bridges.get(record.get("bridge", self.default_bridge_id))
+                    if bridge is not None:
+                        bridge.load_resources(record["resources"])  # e.g. recorded again after a restart
+                    continue
+                if not isinstance(record, dict) or "t" not in record or "event" not in record:
+                    self.logger.error(f"Recorded event without a time or event: {line.strip()}")
+                    continue
+                if first_t is None:
+                    first_t = record["t"]
+                if self.speed > 0:
+                    delay = (record["t"] - first_t) / self.speed - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                count += 1
+                bridge_id = record.get("bridge", self.default_bridge_id)
+                if bridge_id in self.bridges:
+                    self.bridges[bridge_id].apply_event(record["event"])
+                yield bridge_id, record["event"]
+        self.logger.info(f"Replayed {count} events in {time.monotonic() - started:.3f} s")
+
+
+def parse_replay_speed(value: str) -> float:
+    """Parses a replay speed like '1', '10' or 'max' (as fast as possible)."""
+    return 0 if value.lower() == "max" else float(value)
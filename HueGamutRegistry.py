@@ -0,0 +1,128 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import json
+import os
+import threading
+from logging import Logger
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from ColorConverter import Converter, GamutC, XYPoint, get_light_gamut
+
+if TYPE_CHECKING:
+    from HueBridge import HueBridge
+    from HueModel import HueLight
+
+Gamut = Tuple[XYPoint, XYPoint, XYPoint]
+
+# Lights with gamut type 'other' (mostly third party bulbs) and lights of an unknown model get the
+# widest Hue gamut, so no color they report is clipped.
+FALLBACK_GAMUT = GamutC
+
+
+class HueGamutRegistry:
+    """Resolves the color converter of a Hue light once, instead of rebuilding it on every update.
+
+    The gamut reported by the light itself comes first. Lights that report no usable gamut are
+    looked up by model id: first in the gamuts other lights of the same model reported, then in the
+    model ids known by ColorConverter and otherwise FALLBACK_GAMUT is used. Model ids come from the
+    device resources of the bridge. Both are kept in a json cache file, so they are known at
+    startup before the bridge has been asked. One Converter is kept per gamut.
+    """
+    cache_path: Optional[str]
+    logger: Optional[Logger]
+    generation: int  # changes when lights may resolve to another converter
+
+    def __init__(self):
+        self.cache_path = None
+        self.logger = None
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # bridges refresh concurrently, each saving the cache
+        self._models: Dict[str, str] = {}  # "<bridge id>/<light id>" -> model id
+        self._gamuts: Dict[str, Gamut] = {}  # model id -> gamut
+        self._converters: Dict[Gamut, Converter] = {}
+
+    def load(self, cache_path: Optional[str], logger: Logger):
+        """Loads the cache file, if there is one."""
+        self.cache_path = cache_path
+        self.logger = logger
+        if not cache_path or not os.path.exists(cache_path):
+            return
+        try:
+            with open(cache_path, encoding="utf-8") as file:
+                cached = json.load(file)
+            with self._lock:
+                self._models.update(cached.get("models", {}))
+                self._gamuts.update((model, tuple(XYPoint(*point) for point in gamut))
+                                    for model, gamut in cached.get("gamuts", {}).items())
+                self.generation += 1
+            logger.info(f"Loaded {len(self._gamuts)} Hue gamuts from {cache_path}")
+        except Exception as e:
+            logger.error(f"Cannot read Hue gamut cache {cache_path}: {e}")
+
+    def refresh(self, hue_bridge: 'HueBridge'):
+        """Learns the model of each light and the gamut of each model from a bridge, and saves the cache."""
+        models = {}
+        for device in hue_bridge.get_resources("device"):
+            model_id = (device.get("product_data") or {}).get("model_id")
+            for service in device.get("services", []):
+                if model_id and service.get("rtype") == "light":
+                    models[f"{hue_bridge.bridge_id}/{service['rid']}"] = model_id
+
+        gamuts = {}
+        for light in hue_bridge.get_resources("light"):
+            color = light.get("color") or {}
+            model_id = models.get(f"{hue_bridge.bridge_id}/{light['id']}")
+            if model_id and color.get("gamut") and color.get("gamut_type") != "other":
+                gamut = color["gamut"]
+                gamuts[model_id] = tuple(XYPoint(gamut[c]["x"], gamut[c]["y"]) for c in ("red", "green", "blue"))
+
+        with self._save_lock:
+            with self._lock:
+                self._models.update(models)
+                self._gamuts.update(gamuts)
+                self.generation += 1
+                cached = {
+                    "models": dict(self._models),
+                    "gamuts": {model: [list(point) for point in gamut] for model, gamut in self._gamuts.items()},
+                }
+            if self.cache_path:
+                with open(self.cache_path, "w", encoding="utf-8") as file:
+                    json.dump(cached, file, indent=1)
+        if self.logger:
+            self.logger.info(f"Indexed {len(models)} Hue light models on bridge {hue_bridge.bridge_id}")
+
+    def converter_for(self, hue_key: Tuple[str, str], hue_light: 'HueLight') -> Converter:
+        """Returns the converter for a light, (bridge id, light id), with the state last received."""
+        color = hue_light.color
+        if color is not None and color.gamut is not None and color.gamut_type != "other":
+            gamut = (
+                XYPoint(color.gamut.red.x, color.gamut.red.y),
+                XYPoint(color.gamut.green.x, color.gamut.green.y),
+                XYPoint(color.gamut.blue.x, color.gamut.blue.y),
+            )
+        else:
+            gamut = self._model_gamut(hue_key)
+
+        with self._lock:
+            converter = self._converters.get(gamut)
+            if converter is None:
+                converter = self._converters[gamut] = Converter(gamut)
+            return converter
+
+    def _model_gamut(self, hue_key: Tuple[str, str]) -> Gamut:
+        bridge_id, light_id = hue_key
+        model_id = self._models.get(f"{bridge_id}/{light_id}")
+        if model_id in self._gamuts:
+            return self._gamuts[model_id]
+        try:
+            return get_light_gamut(model_id)
+        except ValueError:
+            if self.logger:
+                self.logger.info(f"No gamut known for Hue light {light_id} (model {model_id}), using the fallback gamut")
+            return FALLBACK_GAMUT
+
+
+# shared by all fixtures, loaded and refreshed by the controller at startup
+gamut_registry = HueGamutRegistry()
@@ -0,0 +1,106 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+from logging import Logger
+from typing import Any, Dict, FrozenSet, Set
+
+from BackgroundRefresh import BackgroundRefresh
+from HueBridge import HueBridge
+
+
+class HueGroupIndex(BackgroundRefresh):
+    """Caches which lights belong to a room, zone, grouped light or scene.
+
+    Rooms list devices as children, zones list lights, a grouped light is a service of a room or
+    zone and a scene lists its target lights in its actions. The index resolves all of these to
+    light ids so a scene recall can be turned into one batched fixture update.
+
+    A grouped light update does not mean its lights changed: the bridge also reports the aggregate
+    state of the room and of bridge_home when a single light changes. Grouped lights are therefore
+    only used to combine member lights reported in the same event.
+    """
+    GROUP_TYPES = ("room", "zone", "bridge_home")
+    MEMBERSHIP_TYPES = ("light", "device", "room", "zone", "bridge_home", "scene")
+    refresh_name = "Hue group index"
+
+    hue_bridge: HueBridge
+    logger: Logger
+
+    def __init__(self, hue_bridge: HueBridge, logger: Logger):
+        self.hue_bridge = hue_bridge
+        self.logger = logger
+        self._members: Dict[str, FrozenSet[str]] = {}  # group, grouped_light or scene id -> light ids
+        self._home_grouped_lights: FrozenSet[str] = frozenset()  # grouped_light ids of bridge_home
+        self._init_refresh()
+
+    def _rebuild(self):
+        """Rebuilds the index from the bridge and swaps it in as a whole."""
+        device_lights: Dict[str, Set[str]] = {}
+        for device in self.hue_bridge.get_resources("device"):
+            device_lights[device["id"]] = {service["rid"] for service in device.get("services", [])
+                                           if service["rtype"] == "light"}
+
+        members: Dict[str, FrozenSet[str]] = {}
+        home_grouped_lights: Set[str] = set()
+        # bridge_home lists rooms as children, so rooms must be resolved before it
+        for group_type in self.GROUP_TYPES:
+            for group in self.hue_bridge.get_resources(group_type):
+                lights: Set[str] = set()
+                for child in group.get("children", []):
+                    if child["rtype"] == "light":
+                        lights.add(child["rid"])
+                    elif child["rtype"] == "device":
+                        lights |= device_lights.get(child["rid"], set())
+                    else:
+                        lights |= members.get(child["rid"], frozenset())
+                members[group["id"]] = frozenset(lights)
+                for service in group.get("services", []):
+                    if service["rtype"] == "grouped_light":
+                        members[service["rid"]] = members[group["id"]]
+                        if group_type == "bridge_home":
+                            home_grouped_lights.add(service["rid"])
+
+        for scene in self.hue_bridge.get_resources("scene"):
+            lights = {action["target"]["rid"] for action in scene.get("actions", [])
+                      if action.get("target", {}).get("rtype") == "light"}
+            if not lights and "group" in scene:
+                lights = members.get(scene["group"]["rid"], frozenset())
+            members[scene["id"]] = frozenset(lights)
+
+        self._members = members
+        self._home_grouped_lights = frozenset(home_grouped_lights)
+        self.logger.info(f"Indexed {len(members)} Hue groups and scenes")
+
+    def lights_of(self, resource_id: str) -> FrozenSet[str]:
+        return self._members.get(resource_id, frozenset())
+
+    def grouped_lights(self, item: Dict[str, Any]) -> FrozenSet[str] | None:
+        """Returns the lights of a room or zone grouped light event item, or None for other items.
+
+        The grouped light of bridge_home contains every light, so it is never used to combine lights.
+        """
+        if item.get("type") != "grouped_light":
+            return None
+        if item["id"] in self._home_grouped_lights or item.get("owner", {}).get("rtype") == "bridge_home":
+            return frozenset()
+        return self.lights_of(item["id"])
+
+    def affected_lights(self, item: Dict[str, Any]) -> FrozenSet[str] | None:
+        """Returns the lights affected by a scene event item, or None for other items."""
+        item_type = item.get("type")
+        if item_type == "scene":
+            # a scene recall shows up as a status change to 'static' or 'dynamic_palette'
+            status = item.get("status", {}).get("active")
+            if status and status != "inactive":
+                return self.lights_of(item["id"])
+            return frozenset()
+        return None
+
+    def is_membership_change(self, event_type: str, item: Dict[str, Any]) -> bool:
+        """Checks if an event item changes group membership, in which case the index is stale."""
+        item_type = item.get("type")
+        if item_type not in self.MEMBERSHIP_TYPES:
+            return False
+        if event_type in ("add", "delete"):
+            return True
+        return "children" in item or "actions" in item or "services" in item
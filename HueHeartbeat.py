@@ -0,0 +1,74 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import threading
+import time
+from logging import Logger
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
+
+from HueBridge import HueBridge
+from HueRequestScheduler import PRIORITY_HEARTBEAT
+
+if TYPE_CHECKING:
+    from HueModel import HueLight
+
+
+class HueHeartbeat:
+    """Keeps the Hue event stream alive when nothing happens on the bridge.
+
+    The bridge drops a silent event stream, so during quiet periods the heartbeat toggles the
+    metadata function of a light, which makes the bridge send an event. A heartbeat is only sent
+    when the stream has been silent for a full interval. The function last set is remembered, so
+    apart from the very first heartbeat no light state needs to be fetched. The event caused by
+    the heartbeat itself is recognized with `is_echo` so it can be dropped.
+    """
+    ECHO_KEYS = {"id", "id_v1", "type", "owner", "metadata", "service_id"}
+
+    hue_bridge: HueBridge
+    hue_light_id: str
+    interval_sec: float
+    logger: Logger
+
+    def __init__(self, hue_bridge: HueBridge, hue_light_id: str, interval_sec: float,
+                 get_cached_light: Callable[[], Optional['HueLight']], logger: Logger):
+        self.hue_bridge = hue_bridge
+        self.hue_light_id = hue_light_id
+        self.interval_sec = interval_sec
+        self.get_cached_light = get_cached_light
+        self.logger = logger
+        self._function: Optional[str] = None  # metadata function as last set by the heartbeat
+        self._pending_function: Optional[str] = None  # function of which the echo is expected
+
+    def start(self):
+        def heartbeat():
+            while True:
+                idle_sec = time.monotonic() - self.hue_bridge.last_stream_activity
+                if idle_sec < self.interval_sec:
+                    time.sleep(self.interval_sec - idle_sec)
+                    continue
+                try:
+                    self._beat()
+                except Exception as e:
+                    self.logger.error("Error sending heartbeat to Hue bridge: %s", e)
+                time.sleep(self.interval_sec)
+
+        threading.Thread(target=heartbeat, daemon=True).start()
+
+    def _beat(self):
+        if self._function is None:
+            hue_light = self.get_cached_light() or self.hue_bridge.get_light(self.hue_light_id, PRIORITY_HEARTBEAT)
+            self._function = hue_light.metadata.function
+        function = "unknown" if self._function == "mixed" else "mixed"
+        self._pending_function = function  # the echo may arrive before the request returns
+        self.hue_bridge.set_light_state(self.hue_light_id, {"metadata": {"function": function}},
+                                        PRIORITY_HEARTBEAT)
+        self._function = function
+
+    def is_echo(self, item: Dict[str, Any]) -> bool:
+        """Checks if an event item only reports the metadata change made by the last heartbeat."""
+        if self._pending_function is None or item.get("id") != self.hue_light_id:
+            return False
+        if not self.ECHO_KEYS.issuperset(item) or item.get("metadata", {}).get("function") != self._pending_function:
+            return False
+        self._pending_function = None
+        return True
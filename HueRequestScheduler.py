@@ -0,0 +1,202 @@
+"""
+Copyright (c) 2023 Tom Kalmijn / MIT License.
+"""
+import heapq
+import itertools
+import threading
+import time
+from logging import Logger
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+# Request priorities, lower goes first
+PRIORITY_REFRESH = 0  # fixture updates for a Hue event, visible to the user
+PRIORITY_RESYNC = 1  # validating fixtures, indexing groups, buttons and gamuts
+PRIORITY_HEARTBEAT = 2
+PRIORITY_NAMES = {PRIORITY_REFRESH: "refresh", PRIORITY_RESYNC: "resync", PRIORITY_HEARTBEAT: "heartbeat"}
+
+# Responses that mean the bridge is overloaded, the request is retried after a pause
+RETRY_STATUS = (429, 503)
+MAX_RETRIES = 4
+BACKOFF_SEC = 0.5  # doubles with each retry, unless the bridge sends Retry-After
+
+
+class HueRequest:
+    """A request waiting for, or being sent by, the scheduler. Callers asking for the same resource
+    before it is sent share it, for a write only when they send the same body."""
+    __slots__ = ("method", "url", "kwargs", "priority", "key", "sequence", "attempts", "queued_at",
+                 "dispatched", "done", "response", "error", "forward")
+
+    def __init__(self, method: str, url: str, kwargs: Dict[str, Any], priority: int, sequence: int):
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+        self.priority = priority
+        self.key = (method, url)
+        self.sequence = sequence  # queue order, kept on retry so writes to a resource stay in order
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+        self.dispatched = False
+        self.done = threading.Event()
+        self.response: Optional[requests.Response] = None
+        self.error: Optional[Exception] = None
+        self.forward: Optional['HueRequest'] = None  # a later request for the same resource took over
+
+    def wait(self) -> requests.Response:
+        request = self
+        request.done.wait()
+        while request.forward is not None:
+            request = request.forward
+            request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.response
+
+
+class HueRequestScheduler:
+    """Sends the requests of a Hue bridge by priority, at most `requests_per_sec` on average.
+
+    The rate is enforced with a token bucket holding up to one second worth of requests, so a short
+    burst goes out at once. A request for a resource that is already waiting to be sent is collapsed
+    into the waiting one: both callers get the same response. A write is only collapsed into the last
+    write queued for its resource, and only when the body is identical, otherwise it is queued behind
+    it. When the bridge answers 429 or 503 all requests pause, the failed request is put back in the
+    queue at its old place and retried up to MAX_RETRIES times with exponential backoff.
+    """
+    session: requests.Session
+    requests_per_sec: float
+    logger: Logger
+
+    def __init__(self, session: requests.Session, requests_per_sec: float, max_concurrent: int, logger: Logger):
+        self.session = session
+        self.requests_per_sec = requests_per_sec
+        self.logger = logger
+        self._condition = threading.Condition()
+        self._queue: List[Tuple[int, int, int, HueRequest]] = []  # heap, may hold requests already sent
+        self._pending: Dict[Tuple[str, str], HueRequest] = {}  # the last request waiting to be sent, by resource
+        self._waiting = 0  # requests waiting to be sent
+        self._sequence = itertools.count()
+        self._tokens = float(requests_per_sec)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._metrics = {"sent": 0, "collapsed": 0, "retries": 0, "failed": 0, "backoff_sec": 0.0}
+        self._wait_sec = {priority: [0, 0.0, 0.0] for priority in PRIORITY_NAMES}  # count, total, max
+        for i in range(max_concurrent):
+            threading.Thread(target=self._run, name=f"hue-requests-{i}", daemon=True).start()
+
+    def request(self, method: str, url: str, priority: int = PRIORITY_REFRESH, **kwargs) -> requests.Response:
+        """Queues a request and blocks until its response is in, raises when it failed."""
+        with self._condition:
+            request = self._pending.get((method, url))
+            if request is None or (method != "GET" and request.kwargs != kwargs):
+                request = HueRequest(method, url, kwargs, priority, next(self._sequence))
+                self._pending[request.key] = request
+                self._waiting += 1
+                self._push(request)
+            else:
+                self._metrics["collapsed"] += 1
+                # a write keeps its priority, so it is not sent before earlier writes to the resource
+                if method == "GET" and priority < request.priority:
+                    request.priority = priority
+                    self._push(request)  # the entry with the old priority is skipped
+            self._condition.notify()
+        return request.wait()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Returns request counts, retries, time spent backing off and queue wait per priority in ms."""
+        with self._condition:
+            result: Dict[str, Any] = dict(self._metrics, queued=self._waiting)
+            for priority, (count, total, longest) in self._wait_sec.items():
+                if count:
+                    name = PRIORITY_NAMES[priority]
+                    result[f"{name}_wait_mean_ms"] = total / count * 1000
+                    result[f"{name}_wait_max_ms"] = longest * 1000
+            return result
+
+    def _push(self, request: HueRequest):
+        heapq.heappush(self._queue, (request.priority, request.sequence, next(self._sequence), request))
+
+    def _delay(self, now: float) -> Optional[float]:
+        """Returns how long to wait before the next request may be sent, None when there is none."""
+        if not self._waiting:
+            return None
+        self._tokens = min(self._tokens + (now - self._refilled_at) * self.requests_per_sec, self.requests_per_sec)
+        self._refilled_at = now
+        token_delay = (1 - self._tokens) / self.requests_per_sec if self._tokens < 1 else 0
+        return max(self._paused_until - now, token_delay)
+
+    def _next(self) -> HueRequest:
+        """Takes the request with the highest priority, the caller holds the condition."""
+        while True:
+            priority, _, _, request = heapq.heappop(self._queue)
+            if not request.dispatched and priority == request.priority:
+                request.dispatched = True
+                self._waiting -= 1
+                if self._pending.get(request.key) is request:
+                    del self._pending[request.key]
+                return request
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    delay = self._delay(time.monotonic())
+                    if delay is None:
+                        self._condition.wait()
+                    elif delay > 0:
+                        self._condition.wait(delay)
+                    else:
+                        break
+                self._tokens -= 1
+                request = self._next()
+                waited = time.monotonic() - request.queued_at
+                stats = self._wait_sec[request.priority]
+                stats[0] += 1
+                stats[1] += waited
+                stats[2] = max(stats[2], waited)
+            self._send(request)
+
+    def _send(self, request: HueRequest):
+        try:
+            response = self.session.request(request.method, request.url, headers={"Accept": "application/json"},
+                                            **request.kwargs)
+            with self._condition:
+                self._metrics["sent"] += 1
+            if response.status_code in RETRY_STATUS and request.attempts < MAX_RETRIES:
+                self._retry(request, response)
+                return
+            response.raise_for_status()
+            request.response = response
+        except Exception as e:
+            with self._condition:
+                self._metrics["failed"] += 1
+            request.error = e
+        request.done.set()
+
+    def _retry(self, request: HueRequest, response: requests.Response):
+        """Pauses all requests and puts the request back in the queue."""
+        try:
+            delay = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            delay = BACKOFF_SEC * 2 ** request.attempts
+        self.logger.warning("Hue bridge answered %s, retrying %s %s in %.1f s",
+                            response.status_code, request.method, request.url, delay)
+        with self._condition:
+            self._metrics["retries"] += 1
+            self._metrics["backoff_sec"] += delay
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            request.attempts += 1
+            newer = self._pending.get(request.key)
+            if newer is not None and (request.method == "GET" or newer.kwargs == request.kwargs):
+                # the resource was asked for again in the meantime, the new request answers both
+                request.forward = newer
+                request.done.set()
+            else:
+                request.dispatched = False
+                request.queued_at = time.monotonic()
+                if newer is None:
+                    self._pending[request.key] = request
+                self._waiting += 1
+                self._push(request)
+            self._condition.notify()
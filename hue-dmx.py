@@ -3,5 +3,6 @@ from DmxController import DmxController
 if __name__ == "__main__":
     controller = DmxController()
     controller.send_heartbeat()
+    controller.watch_fixtures()
     controller.track_and_update_fixtures()
 